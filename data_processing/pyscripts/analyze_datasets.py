@@ -6,17 +6,46 @@ from wiki_node import WikiDataNode
 from itertools import product
 from datetime import datetime
 import numpy as np
-import random
-import pickle
 import os
 import json
 import sys
 
 import process_dataset
+import binary_dataset
+from dataset_store import load_dataset, DatasetStore
 
-def calculate_connectivity_stats(nodes, label_list):
+def graph_arrays(nodes, label_list):
     """
-    Calculate the following stats:
+    Get the label indices (in label_list) of the nodes of a dataset and their
+    outgoing links in CSR form (indptr, indices) as positions of the target
+    nodes. For a dataset store these are read from its arrays without
+    creating any node objects.
+    """
+    if isinstance(nodes, DatasetStore):
+        label_ids = {lab: i for i, lab in enumerate(label_list)}
+        remap = np.array([label_ids[lab] for lab in nodes.label_names],
+                         dtype=np.int64)
+        label_vec = remap[nodes.labels]
+        indptr = np.asarray(nodes.outlinks_indptr)
+        indices = np.searchsorted(nodes.ids, nodes.outlinks_indices)
+        return label_vec, indptr, indices
+
+    label_ids = {lab: i for i, lab in enumerate(label_list)}
+    positions = {id: i for i, id in enumerate(nodes)}
+    node_list = list(nodes.values())
+    label_vec = np.array([label_ids[node.label] for node in node_list],
+                         dtype=np.int64)
+    indptr = np.zeros(len(node_list) + 1, dtype=np.int64)
+    np.cumsum([len(node.outlinks) for node in node_list], out=indptr[1:])
+    indices = np.array([positions[id] for node in node_list
+                        for id in node.outlinks], dtype=np.int64)
+    return label_vec, indptr, indices
+
+
+def calculate_connectivity_stats(label_vec, indptr, indices, n_labels):
+    """
+    Calculate the following stats from the arrays returned by graph_arrays for
+    a dataset with n_labels labels:
     - connectivity_matrix: matrix of conditional probabilities that a specific
         node with label A links to a specific other node with label B.
     - inside_connectivity: overall probability that two nodes with the same
@@ -24,29 +53,20 @@ def calculate_connectivity_stats(nodes, label_list):
     - inter_connectivity: overall probability that two nodes with different
         labels are connected
     """
-    C = len(label_list)
-    ids = {lab: i for lab,i in zip(label_list, range(C))}
-
-    link_counts = np.zeros((C, C))
-    nodes_for_label = np.zeros(C)
-
-    for node in nodes.values():
-        nodes_for_label[ids[node.label]] += 1
-        for id in node.outlinks:
-            link_counts[ids[node.label]][ids[nodes[id].label]] += 1
+    C = n_labels
+    source_labels = np.repeat(label_vec, np.diff(indptr))
+    target_labels = label_vec[indices]
+    link_counts = np.bincount(source_labels*C + target_labels,
+                              minlength=C*C).reshape((C, C)).astype(float)
+    nodes_for_label = np.bincount(label_vec, minlength=C).astype(float)
 
     connectivities = (link_counts /
         (nodes_for_label*np.reshape(nodes_for_label, (C, 1))))
-    inside_links = sum([link_counts[i][i] for i in range(C)])
-    inside_link_bound = sum([s*s for s in nodes_for_label])
+    inside_links = np.trace(link_counts)
+    inside_link_bound = np.sum(nodes_for_label*nodes_for_label)
     inside_connectivity = inside_links / inside_link_bound
-    inter_links = sum(
-        [link_counts[i][j] for (i,j) in product(range(C),range(C)) if i != j]
-    )
-    inter_link_bound = sum(
-        [nodes_for_label[i]*nodes_for_label[j]
-            for (i,j) in product(range(C),range(C)) if i != j]
-    )
+    inter_links = np.sum(link_counts) - inside_links
+    inter_link_bound = np.sum(nodes_for_label)**2 - inside_link_bound
     inter_connectivity = inter_links / inter_link_bound
     return {
         'inside_connectivity': float(inside_connectivity),
@@ -55,79 +75,166 @@ def calculate_connectivity_stats(nodes, label_list):
     }
 
 
-def calculate_avg_cosine_similarities(nodes, label_list, sample_count=1000):
+# Number of sampled node pairs whose vectors are gathered at once
+_SIMILARITY_CHUNK_SIZE = 2**14
+
+
+def feature_matrix(nodes, label_list):
+    """
+    Get the vectors of the nodes of a dataset as rows of a matrix, with the
+    vector of their label indices (in label_list).
+    """
+    label_ids = {lab: i for i, lab in enumerate(label_list)}
+    node_list = list(nodes.values())
+    features = np.array([node.vector for node in node_list], dtype=float)
+    label_vec = np.array([label_ids[node.label] for node in node_list],
+                         dtype=np.int64)
+    return features, label_vec
+
+
+def normalize_rows(features):
+    """
+    Scale the rows of a matrix to unit length, returning the scaled matrix and
+    a mask of the rows that are not zero (which are left as zeros).
+    """
+    norms = np.sqrt(np.sum(features*features, axis=1))
+    nonzero = norms > 0
+    return features / np.where(nonzero, norms, 1).reshape((-1, 1)), nonzero
+
+
+def calculate_avg_cosine_similarities(nodes, label_list, sample_count=1000,
+                                      exact=False, seed=None):
     """
     Calculate the average cosine similarities between vectors of nodes from
-    every pair of classes.
+    every pair of classes, ignoring zero vectors.
+
+    By default the average for each pair of classes is estimated from up to
+    sample_count random pairs of nodes. If exact, it is calculated over all
+    pairs of nodes, as the dot product of the mean normalized vectors of the
+    two classes.
     """
     C = len(label_list)
-    totals = np.zeros((C, C))
-    valids = np.zeros((C, C))
-    nodes_per_label = [[node for node in nodes.values() if lab == node.label]
-        for lab in label_list]
-
-    for i,j in product(range(C), range(C)):
+    features, label_vec = feature_matrix(nodes, label_list)
+    normalized, valid = normalize_rows(features)
+
+    if exact:
+        means = np.array([normalized[valid & (label_vec == i)].mean(axis=0)
+                          for i in range(C)])
+        return means @ means.T
+
+    rng = np.random.RandomState(seed)
+    nodes_per_label = [np.flatnonzero(label_vec == i) for i in range(C)]
+    left, right, pairs = [], [], []
+    for i, j in product(range(C), range(C)):
         samples = min(sample_count,
                       min(len(nodes_per_label[i]), len(nodes_per_label[j])))
-        left = random.sample(nodes_per_label[i], samples)
-        right = random.sample(nodes_per_label[j], samples)
-        for node1, node2 in zip(left, right):
-            v1 = node1.vector
-            v2 = node2.vector
-            l1 = np.sum(v1*v1)
-            l2 = np.sum(v2*v2)
-            if l1 > 0 and l2 > 0:
-                valids[i][j] += 1
-                totals[i][j] += np.sum(v1*v2)/(l1*l2)
-    totals /= valids
-    return totals
-
-def cosine_similarity_classification_accuracy(nodes):
+        left.append(rng.choice(nodes_per_label[i], samples, replace=False))
+        right.append(rng.choice(nodes_per_label[j], samples, replace=False))
+        pairs.append(np.full(samples, i*C + j))
+    left = np.concatenate(left)
+    right = np.concatenate(right)
+    pairs = np.concatenate(pairs)
+
+    both_valid = valid[left] & valid[right]
+    similarities = np.empty(len(pairs))
+    for start in range(0, len(pairs), _SIMILARITY_CHUNK_SIZE):
+        chunk = slice(start, start + _SIMILARITY_CHUNK_SIZE)
+        similarities[chunk] = np.einsum('ij,ij->i', normalized[left[chunk]],
+                                        normalized[right[chunk]])
+    totals = np.bincount(pairs, weights=similarities*both_valid,
+                         minlength=C*C)
+    valids = np.bincount(pairs, weights=both_valid, minlength=C*C)
+    return (totals / valids).reshape((C, C))
+
+
+def nearest_centroid_accuracy(features, label_vec, n_classes, train=None,
+                              test=None):
+    """
+    Calculate the accuracy of classifying nodes by the class average vector
+    (over the train nodes) with the highest cosine similarity to their vector,
+    evaluated on the test nodes. Train and test nodes are given as boolean
+    masks or index arrays, all nodes by default. Features may be a dense array
+    or a sparse matrix.
+    """
+    train = slice(None) if train is None else train
+    test = slice(None) if test is None else test
+    train_labels = label_vec[train]
+    one_hot = (train_labels.reshape((-1, 1)) ==
+               np.arange(n_classes).reshape((1, -1))).astype(features.dtype)
+    centroids = np.asarray(features[train].T @ one_hot).T
+    norms = np.sqrt(np.sum(centroids*centroids, axis=1))
+    # Classes without train nodes get zero centroids
+    centroids /= np.where(norms > 0, norms, 1).reshape((-1, 1))
+    predictions = np.argmax(np.asarray(features[test] @ centroids.T), axis=1)
+    return float(np.mean(predictions == label_vec[test]))
+
+
+def cosine_similarity_classification_accuracy(nodes, train_masks=None,
+                                              val_masks=None):
     """
     Calculate how accurately we could classify nodes by calculating the average
     vector of each class and mapping each example to the closest of those class
-    averages. No train/test split so just serves as a quick ballpark, not a
-    rigorous measure.
-    """
-    labels = process_dataset.label_set(nodes)
-    label_ids = {lab: i for lab,i in zip(labels, range(len(labels)))}
-    id_to_label = {i: lab for lab,i in label_ids.items()}
-    words_dim = len(next(iter(nodes.values())).vector)
-    label_freqs = np.zeros(len(labels))
-    avg_vecs = np.zeros((len(labels), words_dim))
-    for node in nodes.values():
-        avg_vecs[label_ids[node.label]] += node.vector
-        label_freqs[label_ids[node.label]] += 1
-
-    # Normalize row vectors
-    avg_vecs /= np.sqrt(np.sum(avg_vecs*avg_vecs, axis=1)).reshape((-1,1))
-    correct_count = 0
-    for node in nodes.values():
-        closest_id = np.argmax(np.sum(avg_vecs*node.vector, axis=1))
-        if id_to_label[closest_id] == node.label:
-            correct_count += 1
-
-    return correct_count / len(nodes)
+    averages.
+
+    Without masks there is no train/test split, so this just serves as a quick
+    ballpark. Given lists of train and validation masks (or index arrays), the
+    class averages are taken over the train nodes and the accuracy on the
+    validation nodes of each split is returned as a list.
+    """
+    labels = sorted(process_dataset.label_set(nodes))
+    features, label_vec = feature_matrix(nodes, labels)
+    if train_masks is None:
+        return nearest_centroid_accuracy(features, label_vec, len(labels))
+    return [nearest_centroid_accuracy(features, label_vec, len(labels),
+                                      train, val)
+            for train, val in zip(train_masks, val_masks)]
+
+
+def nearest_centroid_baseline(binary_filename):
+    """
+    Calculate the validation accuracy of the nearest centroid classifier on
+    each split of a dataset exported by process_dataset.output_binary_data.
+    """
+    data = np.load(binary_filename)
+    features = binary_dataset.binary_features(data).astype(float)
+    label_vec = data['labels']
+    n_classes = int(label_vec.max()) + 1 if len(label_vec) else 0
+    return [nearest_centroid_accuracy(features, label_vec, n_classes,
+                                      train, val)
+            for train, val in zip(data['train_idx'], data['val_idx'])]
 
 
 def analyze_nodes(nodes):
-    labels = list(process_dataset.label_set(nodes))
+    if isinstance(nodes, DatasetStore):
+        labels = list(nodes.label_names)
+    else:
+        labels = sorted(process_dataset.label_set(nodes))
+    label_vec, indptr, indices = graph_arrays(nodes, labels)
+    label_sizes = np.bincount(label_vec, minlength=len(labels))
     sizes = {
         'total': len(nodes),
-        'label_sizes': {lab: sum(lab == node.label for node in nodes.values())
-            for lab in labels}
+        'label_sizes': {lab: int(size)
+            for lab, size in zip(labels, label_sizes)}
     }
     all_stats = {
         'labels': labels,
         'sizes': sizes,
-        'connectivity': calculate_connectivity_stats(nodes, labels),
+        'connectivity': calculate_connectivity_stats(
+            label_vec, indptr, indices, len(labels)),
     }
     return all_stats
 
 
 def analyze(data_dir):
-    data = pickle.load(open(os.path.join(data_dir, 'fulldata.pickle'), 'rb'))
+    data = load_dataset(data_dir)
     stats = analyze_nodes(data)
+    binary_filename = os.path.join(data_dir, 'vectors.npz')
+    if os.path.exists(binary_filename):
+        accuracies = nearest_centroid_baseline(binary_filename)
+        stats['nearest_centroid_val_accuracy'] = {
+            'splits': accuracies,
+            'mean': float(np.mean(accuracies)) if accuracies else None
+        }
     json.dump(stats, open(os.path.join(data_dir, 'analysis.txt'), 'w'),
                 indent=4)
 
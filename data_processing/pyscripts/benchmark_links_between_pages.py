@@ -0,0 +1,132 @@
+"""
+Benchmark the vectorised links_between_pages_vectorised join against the
+dict-based links_between_pages on synthetic page, redirect and pagelinks
+tables, comparing wall time and peak traced memory and checking that both
+produce the same links.
+"""
+import argparse
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from extract_full_data_for_dataset import (PageIndex, links_between_pages,
+                                           links_between_pages_vectorised,
+                                           csr_to_links)
+from preprocess_mysqldumps import (TABLES, main_namespace_filter,
+                                   dump_to_columnar_table)
+from mysqldump_to_csv import dump_to_csv
+
+_SCHEMAS = {
+    'page': ['page_id', 'page_namespace', 'page_title', 'page_is_redirect'],
+    'redirect': ['rd_from', 'rd_namespace', 'rd_title'],
+    'pagelinks': ['pl_from', 'pl_namespace', 'pl_title', 'pl_from_namespace'],
+}
+
+
+def _write_dump(filename, table, rows, rows_per_statement=5000):
+    with open(filename, 'w', encoding='utf-8') as dump:
+        dump.write('CREATE TABLE `{}` (\n'.format(table))
+        for column in _SCHEMAS[table]:
+            dump.write('  `{}` varbinary(255) NOT NULL,\n'.format(column))
+        dump.write(') ENGINE=InnoDB;\n')
+        for i in range(0, len(rows), rows_per_statement):
+            dump.write('INSERT INTO `{}` VALUES '.format(table) + ','.join(
+                '(' + ','.join(str(v) if isinstance(v, int) else "'" + v + "'"
+                               for v in row) + ')'
+                for row in rows[i:i+rows_per_statement]) + ';\n')
+
+
+def write_synthetic_tables(work_dir, n_pages, n_links, seed=42):
+    """
+    Write synthetic dumps of the three tables to work_dir and preprocess them
+    into both CSV and columnar form. Returns the IDs of non-redirect pages.
+    """
+    rnd = random.Random(seed)
+    titles = ['Page_{}_{}'.format(i, rnd.randrange(10**6))
+              for i in range(n_pages)]
+    is_redirect = [rnd.random() < 0.2 for _ in range(n_pages)]
+    pages = [(i + 1, rnd.choice([0, 0, 0, 1]), t, int(r))
+             for i, (t, r) in enumerate(zip(titles, is_redirect))]
+    redirects = [(i + 1, 0, rnd.choice(titles))
+                 for i in range(n_pages) if is_redirect[i]]
+    links = [(rnd.randint(1, n_pages), rnd.choice([0, 0, 0, 4]),
+              rnd.choice(titles) if rnd.random() < 0.9 else 'Missing_page',
+              rnd.choice([0, 0, 0, 1]))
+             for _ in range(n_links)]
+    for table, rows in [('page', pages), ('redirect', redirects),
+                        ('pagelinks', links)]:
+        _write_dump(os.path.join(work_dir, table + '.sql'), table, rows)
+    for table, filter_indices, columns in TABLES:
+        source = os.path.join(work_dir, table + '.sql')
+        row_filter = main_namespace_filter(filter_indices)
+        dump_to_csv(source, os.path.join(work_dir, table + '.csv'),
+                    row_filter, columns, progress_interval=None)
+        dump_to_columnar_table(source, os.path.join(work_dir, table),
+                               row_filter, columns, progress_interval=None)
+    return [p[0] for p in pages if p[1] == 0 and not p[3]]
+
+
+def measure(function, *args):
+    """
+    Run function, returning its result, wall time and peak traced memory.
+    """
+    tracemalloc.start()
+    start = time.perf_counter()
+    result = function(*args)
+    elapsed = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return result, elapsed, peak
+
+
+def dict_join(page_id_set, work_dir):
+    page_index = PageIndex.load(os.path.join(work_dir, 'page.csv'))
+    return links_between_pages(page_id_set,
+                               os.path.join(work_dir, 'pagelinks.csv'),
+                               page_index,
+                               os.path.join(work_dir, 'redirect.csv'))
+
+
+def vectorised_join(page_id_set, work_dir):
+    return links_between_pages_vectorised(page_id_set,
+                                          os.path.join(work_dir, 'pagelinks'),
+                                          os.path.join(work_dir, 'page'),
+                                          os.path.join(work_dir, 'redirect'))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Compare dict-based and vectorised link extraction')
+    parser.add_argument('--pages', type=int, default=200000,
+        help='Number of pages in the synthetic page table')
+    parser.add_argument('--links', type=int, default=2000000,
+        help='Number of rows in the synthetic pagelinks table')
+    parser.add_argument('--dataset-fraction', type=float, default=0.1,
+        help='Fraction of pages whose outgoing links are extracted')
+    args = parser.parse_args()
+
+    work_dir = tempfile.mkdtemp()
+    try:
+        candidates = write_synthetic_tables(work_dir, args.pages, args.links)
+        page_id_set = set(random.Random(0).sample(
+            candidates, int(args.dataset_fraction * len(candidates))))
+        print('Tables written:', args.pages, 'pages,', args.links,
+              'links,', len(page_id_set), 'pages in dataset')
+
+        dict_links, dict_time, dict_peak = measure(dict_join, page_id_set,
+                                                   work_dir)
+        csr, vec_time, vec_peak = measure(vectorised_join, page_id_set,
+                                          work_dir)
+        print('dict join:       {:7.2f} s, peak {:8.1f} MB'.format(
+            dict_time, dict_peak / 2**20))
+        print('vectorised join: {:7.2f} s, peak {:8.1f} MB'.format(
+            vec_time, vec_peak / 2**20))
+        same_links = csr_to_links(*csr) == dict_links
+        print('Same links:', same_links)
+    finally:
+        shutil.rmtree(work_dir)
+    sys.exit(0 if same_links else 1)
@@ -0,0 +1,81 @@
+"""
+Benchmark the byte-level INSERT tokenizer used by mysqldump_to_csv.dump_to_csv
+against the original csv-module based parser on a synthetic dump resembling
+the pagelinks table, and check that both produce the same CSV.
+"""
+import argparse
+import functools
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+from mysqldump_to_csv import dump_to_csv, legacy_dump_to_csv
+
+
+def write_synthetic_dump(filename, n_statements, rows_per_statement, seed=42):
+    """
+    Write a MySQL dump of (id, namespace, title, namespace) tuples, including
+    titles with escaped quotes and backslashes, and return the number of rows.
+    """
+    rnd = random.Random(seed)
+    words = ['Graph', 'Neural', 'Network', "O\\'Reilly", 'C\\\\C++', 'Tree',
+             'Stack_(data_structure)', 'Ångström', 'List,of,things']
+    with open(filename, 'w', encoding='utf-8') as dump:
+        dump.write('CREATE TABLE `pagelinks` (...);\n')
+        for _ in range(n_statements):
+            rows = ["({},{},'{}',{})".format(
+                        rnd.randrange(10**8), rnd.choice([0, 0, 0, 1, 4]),
+                        '_'.join(rnd.sample(words, 3)), rnd.choice([0, 0, 14]))
+                    for _ in range(rows_per_statement)]
+            dump.write('INSERT INTO `pagelinks` VALUES ' + ','.join(rows)
+                       + ';\n')
+    return n_statements * rows_per_statement
+
+
+def time_conversion(convert, input_filename, output_filename, n_rows):
+    """
+    Run a single conversion and return the throughput in rows per second.
+    """
+    start = time.perf_counter()
+    convert(input_filename, output_filename)
+    elapsed = time.perf_counter() - start
+    return n_rows / elapsed
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Compare MySQL dump to CSV conversion throughput')
+    parser.add_argument('--statements', type=int, default=50,
+        help='Number of INSERT statements in the synthetic dump')
+    parser.add_argument('--rows-per-statement', type=int, default=20000,
+        help='Number of tuples in each INSERT statement')
+    args = parser.parse_args()
+
+    work_dir = tempfile.mkdtemp()
+    try:
+        dump = os.path.join(work_dir, 'pagelinks.sql')
+        n_rows = write_synthetic_dump(dump, args.statements,
+                                      args.rows_per_statement)
+        print('Synthetic dump:', n_rows, 'rows,',
+              os.path.getsize(dump) // 2**20, 'MB')
+
+        legacy_out = os.path.join(work_dir, 'legacy.csv')
+        new_out = os.path.join(work_dir, 'new.csv')
+        legacy_rate = time_conversion(legacy_dump_to_csv, dump, legacy_out,
+                                      n_rows)
+        new_rate = time_conversion(
+            functools.partial(dump_to_csv, progress_interval=None),
+            dump, new_out, n_rows)
+        print('csv-module parser: {:,.0f} rows/s'.format(legacy_rate))
+        print('byte tokenizer:    {:,.0f} rows/s ({:.1f}x)'.format(
+            new_rate, new_rate / legacy_rate))
+
+        with open(legacy_out, 'rb') as a, open(new_out, 'rb') as b:
+            same_output = a.read() == b.read()
+        print('Outputs identical:', same_output)
+    finally:
+        shutil.rmtree(work_dir)
+    sys.exit(0 if same_output else 1)
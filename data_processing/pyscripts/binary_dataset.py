@@ -0,0 +1,52 @@
+"""
+Read the .npz export of a dataset written by
+process_dataset.output_binary_data. Only NumPy and SciPy are needed, so the
+experiments share these functions to turn the export into tensors.
+"""
+import numpy as np
+import scipy.sparse as sp
+
+
+def binary_features(data):
+    """
+    Get the features of a .npz file written by output_binary_data, as a dense
+    array or a sparse CSR matrix as they were written.
+    """
+    if 'features_indptr' in data:
+        return sp.csr_matrix((data['features_data'], data['features_indices'],
+                              data['features_indptr']),
+                             shape=tuple(data['features_shape']))
+    return data['features']
+
+
+def index_mask(n_nodes, indices):
+    """
+    Get a boolean mask over n_nodes nodes selecting those at the given indices.
+    """
+    mask = np.zeros(n_nodes, dtype=bool)
+    mask[indices] = True
+    return mask
+
+
+def split_masks(data):
+    """
+    Get the boolean node masks of the splits in a .npz file written by
+    output_binary_data, as lists of train, validation and stopping masks and a
+    single test mask.
+    """
+    n_nodes = len(data['labels'])
+    train_masks = [index_mask(n_nodes, tr) for tr in data['train_idx']]
+    val_masks = [index_mask(n_nodes, val) for val in data['val_idx']]
+    stopping_masks = [index_mask(n_nodes, st) for st in data['stopping_idx']]
+    test_mask = index_mask(n_nodes, data['test_idx'])
+    return train_masks, val_masks, stopping_masks, test_mask
+
+
+def link_arrays(data):
+    """
+    Get the source and destination nodes of the links in a .npz file written by
+    output_binary_data.
+    """
+    indptr = data['links_indptr']
+    src = np.repeat(np.arange(len(indptr) - 1), np.diff(indptr))
+    return src, data['links_indices']
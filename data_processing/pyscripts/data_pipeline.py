@@ -3,55 +3,246 @@ Extract all relevant page data for a dataset, process it into appropriate form
 for training models and calculate statistics.
 
 Needs as input:
-- Label mapping: list of labels with associated Wikipedia categories for dataset.
-- Wikipedia datadumps of relevant tables preprocessed into CSVs
-    (see preprocess_mysqldumps.py)
+- Label mapping: list of labels with associated Wikipedia categories for dataset,
+    or a file mapping dataset names to label mappings to create several
+    datasets from a single extraction pass
+- Wikipedia datadumps of relevant tables preprocessed into CSVs or the
+    columnar layout, which is used if present (see preprocess_mysqldumps.py)
 - Sanitized category data (as output by the sanitizer tool)
 - Article texts (as output by the text extractor)
-- Word embeddings (in the GloVe embedding file format)
+- Word embeddings (in the GloVe embedding file format), unless the datasets
+    are vectorised with sparse bag-of-words features
 
 Outputs into a given directory:
 - Extracted data about nodes as a map from IDs to WikiDataNode objects in
-    .pickle form (fulldata.pickle)
+    a memory-mapped dataset store (fulldata, see dataset_store.py)
 - Data for training and evaluation in appropriate splits in vector form
     (vectors.json)
-- Readable data equivalent to fulldata.pickle in JSON form (readable.json) with
+- Readable data equivalent to fulldata in JSON form (readable.json) with
     the node order corresponding to that of vectors.json
 - Dataset statistics (analysis.txt)
+- Hashes of the inputs of each completed stage (stages.json), so that reruns
+    skip the stages whose inputs and parameters are unchanged
+In batch mode, each dataset is output into a subdirectory named after it.
 """
 
 import sys
 import os
+import json
 import argparse
-from extract_full_data_for_dataset import extract_by_single_mapping_file
-from process_dataset import process_with_glove_vectors
+from datetime import datetime
+from multiprocessing import Pool
+from extract_full_data_for_dataset import (extract_by_single_mapping_file,
+                                           extract_by_multiple_mappings_file)
+from process_dataset import (process_with_glove_vectors,
+                             process_with_bag_of_words, load_glove_matrix)
 from analyze_datasets import analyze
+from pipeline_stages import stage_digest, stage_is_current, record_stage
+
+# Outputs of each pipeline stage in a dataset directory
+STAGE_OUTPUTS = {
+    'extract': ['fulldata'],
+    'process': ['vectors.json', 'vectors.npz', 'readable.json', 'splits.npz'],
+    'analyze': ['analysis.txt'],
+}
+
+# GloVe embeddings loaded by each worker process of process_and_analyze_all,
+# memory-mapped so that the workers share a single copy of the matrix
+_worker_glove_matrix = None
+
+
+def _init_worker(glove_file):
+    global _worker_glove_matrix
+    _worker_glove_matrix = load_glove_matrix(glove_file)
+
+
+def wiki_table_paths(wiki_dump_dir):
+    """
+    Get the paths of the preprocessed page, pagelinks and redirect tables,
+    preferring the columnar layout (a directory per table) when
+    preprocess_mysqldumps.py wrote all of them in it, otherwise the CSVs.
+    """
+    tables = ('page', 'pagelinks', 'redirect')
+    directories = [os.path.join(wiki_dump_dir, table) for table in tables]
+    if all(os.path.isdir(directory) for directory in directories):
+        return directories
+    return [os.path.join(wiki_dump_dir, table + '.csv') for table in tables]
+
+
+def process_and_analyze(data_dir, glove_file, glove_matrix, output_args,
+                        digests, force=False):
+    """
+    Run the process and analyze stages for the dataset in data_dir, skipping
+    those recorded as completed with the given input digests unless forced.
+    Without a GloVe file, the dataset is vectorised with bag-of-words
+    features.
+    """
+    if force or not stage_is_current(data_dir, 'process', digests['process'],
+                                     STAGE_OUTPUTS['process']):
+        if glove_file is None:
+            process_with_bag_of_words(data_dir, output_args=output_args)
+        else:
+            process_with_glove_vectors(data_dir, glove_file,
+                                       glove_matrix=glove_matrix,
+                                       output_args=output_args)
+        record_stage(data_dir, 'process', digests['process'])
+    if force or not stage_is_current(data_dir, 'analyze', digests['analyze'],
+                                     STAGE_OUTPUTS['analyze']):
+        analyze(data_dir)
+        record_stage(data_dir, 'analyze', digests['analyze'])
+    return data_dir
+
+
+def _process_and_analyze_in_worker(task):
+    return process_and_analyze(task[0], task[1], _worker_glove_matrix,
+                               *task[2:])
+
+
+def process_and_analyze_all(data_dirs, glove_file, processes=None,
+                            output_args=None, digests=None, force=False):
+    """
+    Vectorise and analyze the extracted datasets in the given directories in
+    parallel by the given number of processes (all CPUs by default), skipping
+    stages already completed with the same inputs. Without a GloVe file, the
+    datasets are vectorised with bag-of-words features.
+    """
+    if digests is None:
+        digests = {stage: None for stage in STAGE_OUTPUTS}
+        force = True
+    pending = [data_dir for data_dir in data_dirs
+               if force or not all(
+                   stage_is_current(data_dir, stage, digests[stage],
+                                    STAGE_OUTPUTS[stage])
+                   for stage in ('process', 'analyze'))]
+    for data_dir in data_dirs:
+        if data_dir not in pending:
+            print(datetime.now().strftime('%H:%M:%S'),
+                  'Skipping', data_dir, '(inputs unchanged)')
+    if not pending:
+        return
+
+    # Convert the GloVe file once before the workers memory-map it
+    glove_matrix = (None if glove_file is None
+                    else load_glove_matrix(glove_file))
+    if processes == 1 or len(pending) == 1:
+        for data_dir in pending:
+            process_and_analyze(data_dir, glove_file, glove_matrix,
+                                output_args, digests, force)
+        return
+    del glove_matrix
+    with Pool(processes,
+              initializer=None if glove_file is None else _init_worker,
+              initargs=(glove_file,)) as pool:
+        for data_dir in pool.imap_unordered(
+                _process_and_analyze_in_worker,
+                [(data_dir, glove_file, output_args, digests, force)
+                 for data_dir in pending]):
+            print(datetime.now().strftime('%H:%M:%S'),
+                  'Processed and analyzed', data_dir)
+
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(
         description='Create Wikipedia node classification dataset from sources')
-    parser.add_argument('--label-mapping',
+    mapping = parser.add_mutually_exclusive_group(required=True)
+    mapping.add_argument('--label-mapping',
         help='JSON file giving label mapping')
+    mapping.add_argument('--label-mappings-file',
+        help='JSON file mapping dataset names to label mappings, to extract '
+             'all datasets in one pass')
     parser.add_argument('--wiki-dump-dir',
         help='Directory containing preprocessed page, pagelinks, redirect '
-             'table CSVs')
+             'table CSVs or table directories in columnar layout')
     parser.add_argument('--category-data-dir',
         help='Directory containing sanitized category data')
     parser.add_argument('--text-data-dir',
         help='Directory containing extracted article texts')
     parser.add_argument('--glove-embedding-file', help='Word embedding file')
+    parser.add_argument('--features', default='glove',
+        choices=['glove', 'bag-of-words'],
+        help='Vectorise articles by their averaged GloVe word vectors or as '
+             'sparse bag-of-words features')
     parser.add_argument('--output-dir', help='Directory to write results to')
+    parser.add_argument('--processes', type=int,
+        help='Number of processes vectorising and analyzing datasets in '
+             'batch mode (default: number of CPUs)')
+    parser.add_argument('--token-cache-dir',
+        help='Directory caching tokenized article texts between runs '
+             '(requires texts extracted with revision IDs)')
+    parser.add_argument('--train-ratio', type=float, default=0.05,
+        help='Fraction of each label in the training set of each split')
+    parser.add_argument('--test-ratio', type=float, default=0.5,
+        help='Fraction of each label in the test set')
+    parser.add_argument('--stopping-ratio', type=float, default=0.3,
+        help='Fraction of each label in the early stopping set of each split')
+    parser.add_argument('--n-splits', type=int, default=20,
+        help='Number of random training splits')
+    parser.add_argument('--seed', type=int, default=42,
+        help='Random seed for the data splits')
+    parser.add_argument('--force', action='store_true',
+        help='Rerun all stages even if their inputs are unchanged')
 
     args = parser.parse_args()
+    if args.features == 'glove' and args.glove_embedding_file is None:
+        parser.error('--glove-embedding-file is needed for GloVe features')
 
-    extract_by_single_mapping_file(
-        args.label_mapping,
+    sources = (
         os.path.join(args.category_data_dir, 'page2cat.tsv'),
-        os.path.join(args.wiki_dump_dir, 'page.csv'),
-        os.path.join(args.wiki_dump_dir, 'pagelinks.csv'),
-        os.path.join(args.wiki_dump_dir, 'redirect.csv'),
-        args.text_data_dir,
-        args.output_dir
+        *wiki_table_paths(args.wiki_dump_dir),
+        args.text_data_dir
     )
-    process_with_glove_vectors(args.output_dir, args.glove_embedding_file)
-    analyze(args.output_dir)
+    if args.label_mappings_file is not None:
+        mappings_file = args.label_mappings_file
+        with open(mappings_file) as file:
+            names = list(json.load(file).keys())
+        data_dirs = [os.path.join(args.output_dir, name) for name in names]
+    else:
+        mappings_file = args.label_mapping
+        data_dirs = [args.output_dir]
+    output_args = {
+        'train_ratio': args.train_ratio,
+        'test_ratio': args.test_ratio,
+        'stopping_ratio': args.stopping_ratio,
+        'n_train_splits': args.n_splits,
+        'seed': args.seed,
+    }
+
+    # Later stages depend on the inputs of the earlier ones through the digest
+    # of the extract stage
+    extract_digest = stage_digest(
+        [mappings_file] + list(sources),
+        {'batch': args.label_mappings_file is not None})
+    glove_file = (args.glove_embedding_file if args.features == 'glove'
+                  else None)
+    process_digest = stage_digest([glove_file] if glove_file else [],
+                                  {'extract': extract_digest,
+                                   'output': output_args,
+                                   'features': args.features})
+    digests = {
+        'process': process_digest,
+        # The analysis includes a baseline on the processed data
+        'analyze': stage_digest([], {'process': process_digest}),
+    }
+
+    if args.force or not all(
+            stage_is_current(data_dir, 'extract', extract_digest,
+                             STAGE_OUTPUTS['extract'])
+            for data_dir in data_dirs):
+        if args.label_mappings_file is not None:
+            extract_by_multiple_mappings_file(
+                mappings_file, *sources,
+                args.output_dir, args.token_cache_dir
+            )
+        else:
+            extract_by_single_mapping_file(
+                mappings_file, *sources,
+                args.output_dir, args.token_cache_dir
+            )
+        for data_dir in data_dirs:
+            record_stage(data_dir, 'extract', extract_digest)
+    else:
+        print(datetime.now().strftime('%H:%M:%S'),
+              'Skipping extraction (inputs unchanged)')
+
+    process_and_analyze_all(data_dirs, glove_file, args.processes,
+                            output_args, digests, args.force)
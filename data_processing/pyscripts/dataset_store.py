@@ -0,0 +1,222 @@
+"""
+Directory-based storage of extracted datasets, replacing the fulldata.pickle
+map from page IDs to WikiDataNode objects.
+
+A dataset directory holds a fulldata subdirectory with the nodes sorted by page
+ID in NumPy files that are memory-mapped when the dataset is opened:
+- ids.npy: page IDs
+- labels.npy: indices into label_names.json
+- outlinks.indptr.npy, outlinks.indices.npy: outgoing links as page IDs in CSR
+    form
+- tokens.indptr.npy, tokens.ids.npy: article tokens as indices into vocab.txt
+    (one word per line) in CSR form
+- titles.offsets.npy, titles.bytes: UTF-8 titles delimited by offsets
+
+Nodes are only created when accessed, so tools touching a sample of the nodes
+do not pay for loading the whole graph.
+"""
+import json
+import mmap
+import os
+import pickle
+from collections.abc import Mapping
+
+import numpy as np
+
+from wiki_node import WikiDataNode, Vocabulary, shared_token_ids
+
+STORE_DIRNAME = 'fulldata'
+PICKLE_FILENAME = 'fulldata.pickle'
+
+
+class TextColumn:
+    """
+    Read-only access to a text column of a table in the columnar layout written
+    by preprocess_mysqldumps.py: UTF-8 values concatenated in a memory-mapped
+    blob, delimited by an array of offsets.
+    """
+    def __init__(self, table_dir, name):
+        self.offsets = np.load(os.path.join(table_dir, name + '.offsets.npy'),
+                               mmap_mode='r')
+        with open(os.path.join(table_dir, name + '.bytes'), 'rb') as f:
+            self.data = (mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+                         if os.fstat(f.fileno()).st_size > 0 else b'')
+
+    @classmethod
+    def from_strings(cls, values):
+        """Create an in-memory column holding the given strings."""
+        column = cls.__new__(cls)
+        encoded = [value.encode('utf-8') for value in values]
+        column.offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+        np.cumsum([len(value) for value in encoded], out=column.offsets[1:])
+        column.data = b''.join(encoded)
+        return column
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def raw(self, idx):
+        """Get the value at index idx as UTF-8 bytes."""
+        return self.data[self.offsets[idx]:self.offsets[idx+1]]
+
+    def __getitem__(self, idx):
+        return self.raw(idx).decode('utf-8')
+
+    def __iter__(self):
+        offsets = self.offsets
+        for idx in range(len(self)):
+            yield self.data[offsets[idx]:offsets[idx+1]].decode('utf-8')
+
+    def byte_array(self):
+        """Get the concatenated values as a uint8 NumPy array."""
+        return np.frombuffer(self.data, dtype=np.uint8)
+
+
+def write_text_column(table_dir, name, values):
+    """
+    Write a text column in the layout read by TextColumn.
+    """
+    offsets = [0]
+    with open(os.path.join(table_dir, name + '.bytes'), 'wb') as output:
+        for value in values:
+            encoded = value.encode('utf-8')
+            output.write(encoded)
+            offsets.append(offsets[-1] + len(encoded))
+    np.save(os.path.join(table_dir, name + '.offsets.npy'),
+            np.array(offsets, dtype=np.int64))
+
+
+def _csr_indptr(lengths):
+    indptr = np.zeros(len(lengths) + 1, dtype=np.int64)
+    np.cumsum(lengths, out=indptr[1:])
+    return indptr
+
+
+def write_dataset(nodes, store_dir):
+    """
+    Write a map from page IDs to WikiDataNode objects to store_dir. Node
+    vectors are not stored.
+    """
+    os.makedirs(store_dir, exist_ok=True)
+    ordered = [nodes[id] for id in sorted(nodes)]
+
+    vocab, token_ids = shared_token_ids(ordered)
+
+    label_names = sorted({node.label for node in ordered})
+    label_ids = {label: i for i, label in enumerate(label_names)}
+
+    def save(name, array):
+        np.save(os.path.join(store_dir, name + '.npy'), array)
+
+    save('ids', np.array([node.id for node in ordered], dtype=np.int64))
+    save('labels', np.array([label_ids[node.label] for node in ordered],
+                            dtype=np.int32))
+    save('outlinks.indptr', _csr_indptr([len(node.outlinks)
+                                         for node in ordered]))
+    save('outlinks.indices', np.array(
+        [target for node in ordered for target in node.outlinks],
+        dtype=np.int64))
+    save('tokens.indptr', _csr_indptr([len(ids) for ids in token_ids]))
+    save('tokens.ids', np.concatenate(token_ids).astype(np.int32)
+         if token_ids else np.zeros(0, dtype=np.int32))
+    write_text_column(store_dir, 'titles', (node.title for node in ordered))
+    with open(os.path.join(store_dir, 'label_names.json'), 'w') as output:
+        json.dump(label_names, output)
+    with open(os.path.join(store_dir, 'vocab.txt'), 'w',
+              encoding='utf8') as output:
+        output.write('\n'.join(vocab.words))
+
+
+class DatasetStore(Mapping):
+    """
+    Lazily loaded dataset written by write_dataset, acting as a read-only map
+    from page IDs to WikiDataNode objects. Nodes are created on first access
+    and kept, so changes to them (such as their vectors) persist while the
+    store is open. Iteration is in page ID order.
+    """
+    def __init__(self, store_dir):
+        self.store_dir = store_dir
+
+        def load(name):
+            return np.load(os.path.join(store_dir, name + '.npy'),
+                           mmap_mode='r')
+
+        self.ids = load('ids')
+        self.labels = load('labels')
+        self.outlinks_indptr = load('outlinks.indptr')
+        self.outlinks_indices = load('outlinks.indices')
+        self.tokens_indptr = load('tokens.indptr')
+        self.tokens_ids = load('tokens.ids')
+        self.titles = TextColumn(store_dir, 'titles')
+        with open(os.path.join(store_dir, 'label_names.json')) as input:
+            self.label_names = json.load(input)
+        self._vocab = None
+        self._nodes = {}
+
+    @property
+    def vocab(self):
+        """Vocabulary of the dataset, loaded on first use."""
+        if self._vocab is None:
+            with open(os.path.join(self.store_dir, 'vocab.txt'),
+                      encoding='utf8') as input:
+                text = input.read()
+            self._vocab = Vocabulary(text.split('\n') if text else [])
+        return self._vocab
+
+    def index(self, id):
+        """Get the position of the node with the given page ID in the store."""
+        idx = int(np.searchsorted(self.ids, id))
+        if idx == len(self.ids) or self.ids[idx] != id:
+            raise KeyError(id)
+        return idx
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __iter__(self):
+        return iter(self.ids.tolist())
+
+    def __contains__(self, id):
+        try:
+            self.index(id)
+        except KeyError:
+            return False
+        return True
+
+    def __getitem__(self, id):
+        node = self._nodes.get(id)
+        if node is None:
+            node = self._nodes[id] = self.node_at(self.index(id))
+        return node
+
+    def node_at(self, idx):
+        """Create the node at the given position in the store."""
+        outlinks = self.outlinks_indices[
+            self.outlinks_indptr[idx]:self.outlinks_indptr[idx+1]]
+        token_ids = self.tokens_ids[
+            self.tokens_indptr[idx]:self.tokens_indptr[idx+1]]
+        return WikiDataNode.from_token_ids(
+            int(self.ids[idx]), self.titles[idx],
+            self.label_names[self.labels[idx]], outlinks.tolist(),
+            np.array(token_ids), self.vocab)
+
+
+def save_dataset(nodes, data_dir):
+    """
+    Write a dataset given as a map from page IDs to WikiDataNode objects to
+    the store in data_dir.
+    """
+    write_dataset(nodes, os.path.join(data_dir, STORE_DIRNAME))
+
+
+def load_dataset(data_dir):
+    """
+    Open the dataset in data_dir as a map from page IDs to WikiDataNode
+    objects, falling back to fulldata.pickle for datasets extracted before the
+    directory store was introduced.
+    """
+    store_dir = os.path.join(data_dir, STORE_DIRNAME)
+    if os.path.isdir(store_dir):
+        return DatasetStore(store_dir)
+    with open(os.path.join(data_dir, PICKLE_FILENAME), 'rb') as input:
+        return pickle.load(input)
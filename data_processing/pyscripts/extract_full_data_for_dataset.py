@@ -3,18 +3,23 @@ Extracts relevant node data for pages in given categories (mapped to node
 classes) from Wikipedia database tables (preprocessed to CSV form) and outputs
 of the category sanitizer tool.
 
-Outputs the extracted datasets into .pickle files.
+Outputs the extracted datasets into dataset stores (see dataset_store.py).
 """
 
 import csv
+import itertools
 import os
 import json
+import re
 import nltk
 import string
-import pickle
 import sys
+import numpy as np
 from datetime import datetime
-from wiki_node import WikiDataNode
+from multiprocessing import Pool
+from wiki_node import WikiDataNode, Vocabulary
+from token_cache import TokenCache
+from dataset_store import TextColumn, save_dataset
 from nltk.corpus import stopwords
 
 try:
@@ -25,19 +30,146 @@ except LookupError:
     nktk.download('stopwords')
 
 
-def page_titles_to_ids(titles_set, page_table_filename):
+def table_csv_reader(table_file, table_filename, n_columns):
     """
-    Parse data from the Wikipedia page database table to get page IDs for
-    the given set of page titles.
+    Read the rows of a table CSV written by preprocess_mysqldumps.py, checking
+    that they have the expected number of columns to fail clearly on tables
+    preprocessed by earlier versions which kept other columns.
     """
-    mapping = {}
-    with open(page_table_filename, encoding='utf8') as page_file:
-        reader = csv.reader(page_file)
-        for line in reader:
-            id, namespace, title = int(line[0]), line[1], line[2]
-            if namespace == '0' and title in titles_set:
-                mapping[title] = id
-    return mapping
+    reader = csv.reader(table_file)
+    first = next(reader, None)
+    if first is None:
+        return iter(())
+    if len(first) != n_columns:
+        raise ValueError(
+            '{} has {} columns instead of {}, it was probably preprocessed by '
+            'an older version: re-run preprocess_mysqldumps.py'.format(
+                table_filename, len(first), n_columns))
+    return itertools.chain([first], reader)
+
+
+def load_int_column(table_dir, name):
+    """
+    Memory-map an integer column of a table in the columnar layout written by
+    preprocess_mysqldumps.py.
+    """
+    return np.load(os.path.join(table_dir, name + '.npy'), mmap_mode='r')
+
+
+def load_text_column(table_dir, name):
+    """
+    Open a text column of a table in the columnar layout written by
+    preprocess_mysqldumps.py.
+    """
+    return TextColumn(table_dir, name)
+
+
+def load_page_ids(page_table_dir):
+    """
+    Memory-map the IDs of all main namespace pages, in the order of the page
+    table.
+    """
+    return load_int_column(page_table_dir, 'page_id')
+
+
+class PageIndex:
+    """
+    Index of the main namespace pages in the page table, built in a single pass
+    over it: maps titles to page IDs and back, and records which pages are
+    redirects. Titles are interned so that equal titles read from other tables
+    share the same string objects.
+    """
+    def __init__(self):
+        self.title_to_id = {}
+        self.id_to_title = {}
+        self.redirect_ids = set()
+
+    def add(self, id, title, is_redirect):
+        title = sys.intern(title)
+        self.title_to_id[title] = id
+        self.id_to_title[id] = title
+        if is_redirect:
+            self.redirect_ids.add(id)
+
+    @classmethod
+    def from_csv(cls, page_table_filename):
+        """
+        Build the index from the page table CSV.
+        """
+        index = cls()
+        with open(page_table_filename, encoding='utf8') as page_file:
+            reader = table_csv_reader(page_file, page_table_filename, 4)
+            for line in reader:
+                id, namespace, title, is_redirect = (int(line[0]), line[1],
+                                                     line[2], line[3])
+                if namespace == '0':
+                    index.add(id, title, is_redirect == '1')
+        return index
+
+    @classmethod
+    def from_columns(cls, page_table_dir):
+        """
+        Build the index from the page table in columnar layout.
+        """
+        index = cls()
+        namespaces = load_int_column(page_table_dir, 'page_namespace')
+        is_redirect = load_int_column(page_table_dir, 'page_is_redirect')
+        for i, (id, title) in enumerate(zip(
+                load_page_ids(page_table_dir).tolist(),
+                load_text_column(page_table_dir, 'page_title'))):
+            if namespaces[i] == 0:
+                index.add(id, title, is_redirect[i] == 1)
+        return index
+
+    @classmethod
+    def load(cls, page_table):
+        """
+        Build the index from the page table given either as a CSV file or as a
+        directory in columnar layout.
+        """
+        if os.path.isdir(page_table):
+            return cls.from_columns(page_table)
+        return cls.from_csv(page_table)
+
+    def __len__(self):
+        return len(self.id_to_title)
+
+    def is_redirect(self, id):
+        return id in self.redirect_ids
+
+
+def page_titles_to_ids(titles_set, page_index):
+    """
+    Get page IDs for the given set of page titles from the index of the
+    Wikipedia page database table.
+    """
+    title_to_id = page_index.title_to_id
+    return {title: title_to_id[title] for title in titles_set
+                if title in title_to_id}
+
+
+def page_titles_to_ids_columnar(titles_set, page_lookup, page_table_dir):
+    """
+    Get page IDs for the given set of page titles from the page table in
+    columnar layout, given a TitleLookup over its main namespace rows.
+    """
+    titles = list(titles_set)
+    rows = page_lookup.find(TextColumn.from_strings(titles),
+                            np.arange(len(titles), dtype=np.int64))
+    page_ids = load_page_ids(page_table_dir)
+    return {title: int(page_ids[row])
+            for title, row in zip(titles, rows.tolist()) if row >= 0}
+
+
+def main_page_lookup(page_table_dir):
+    """
+    Build a TitleLookup over the titles of the main namespace pages in the
+    page table in columnar layout.
+    """
+    main_rows = np.nonzero(np.asarray(
+        load_int_column(page_table_dir, 'page_namespace')) == 0)[0]
+    return TitleLookup(load_text_column(page_table_dir, 'page_title'),
+                       main_rows)
 
 
 def page_titles_to_labels(category_label_mapping, page2cat_filename):
@@ -67,110 +199,448 @@ def page_titles_to_labels(category_label_mapping, page2cat_filename):
     return titles_to_labels
 
 
-def load_redirects(page_table_filename, redirect_table_filename):
+def load_redirects(page_index, redirect_table_filename):
     """
     Load the redirect table as a mapping between page IDs. Double redirects not
     handled because they are considered invalid by Wikipedia's standards.
     """
-    target_title_to_source_id = {}
+    title_to_id = page_index.title_to_id
+    source_to_target_id = {}
     with open(redirect_table_filename, encoding='utf8') as redirect_file:
-        reader = csv.reader(redirect_file)
-        for from_id, to_namespace, to_title, _, _ in reader:
-            from_id = int(from_id)
+        reader = table_csv_reader(redirect_file, redirect_table_filename, 3)
+        for from_id, to_namespace, to_title in reader:
             if to_namespace == '0':
-                if to_title not in target_title_to_source_id:
-                    target_title_to_source_id[to_title] = []
-                target_title_to_source_id[to_title].append(from_id)
-
-    source_to_target_id = {}
-    with open(page_table_filename, encoding='utf8') as page_file:
-        reader = csv.reader(page_file)
-        for line in reader:
-            id, title, is_redirect = int(line[0]), line[2], line[5]
-            if is_redirect == '0': # Ignore double redirects
-                for source_id in target_title_to_source_id.get(title, []):
-                    source_to_target_id[source_id] = id
+                target_id = title_to_id.get(to_title)
+                # Ignore double redirects
+                if (target_id is not None
+                    and not page_index.is_redirect(target_id)):
+                    source_to_target_id[int(from_id)] = target_id
 
     return source_to_target_id
 
 
-def links_between_pages(page_id_set, pagelinks_table_filename,
-                        page_table_filename, redirect_table_filename):
+def links_between_pages(page_id_set, pagelinks_table_filename, page_index,
+                        redirect_table_filename):
     """
     Produce the graph of hyperlinks between nodes with page IDs in the given
     set, taking into account redirects.
     """
 
-    # Map target title to source IDs
+    # Map target title to source IDs. The table only holds links between main
+    # namespace pages.
     titles_linked_from = {}
     with open(pagelinks_table_filename, encoding='utf8') as pagelinks_file:
-        reader = csv.reader(pagelinks_file)
-        for from_id, from_namespace, to_title, to_namespace in reader:
+        reader = table_csv_reader(pagelinks_file, pagelinks_table_filename,
+                                  2)
+        for from_id, to_title in reader:
             from_id = int(from_id)
-            if (from_id in page_id_set and
-                from_namespace == '0' and to_namespace == '0'):
+            if from_id in page_id_set:
+                to_title = sys.intern(to_title)
                 if to_title not in titles_linked_from:
                     titles_linked_from[to_title] = []
                 titles_linked_from[to_title].append(from_id)
 
     # Load ID to ID redirects
-    redirects = load_redirects(page_table_filename, redirect_table_filename)
+    redirects = load_redirects(page_index, redirect_table_filename)
 
-    # Produce ID to ID links using by matching titles to IDs in the pages table
+    # Produce ID to ID links by matching titles to IDs in the page index, in
+    # page table order
     links = {id: [] for id in page_id_set}
-    with open(page_table_filename, encoding='utf8') as page_file:
-        reader = csv.reader(page_file)
-        for line in reader:
-            id, title, is_redirect = int(line[0]), line[2], line[5]
-            if is_redirect == '1':
-                if id in redirects:
-                    id = redirects[id]
-                else:
-                    continue
-
-            for source_id in titles_linked_from.get(title, []):
-                links[source_id].append(id)
+    for id, title in page_index.id_to_title.items():
+        source_ids = titles_linked_from.get(title)
+        if source_ids is None:
+            continue
+        if page_index.is_redirect(id):
+            if id in redirects:
+                id = redirects[id]
+            else:
+                continue
+
+        for source_id in source_ids:
+            links[source_id].append(id)
 
     return links
 
 
-def get_text_tokens(page_id_set, text_extractor_data_dir):
+# Odd random multipliers for each byte position in title_hashes
+_TITLE_HASH_WEIGHTS = (np.random.RandomState(2020).randint(
+    0, 2**62, size=1024, dtype=np.int64).astype(np.uint64) * np.uint64(2)
+    + np.uint64(1))
+_TITLE_LENGTH_WEIGHT = np.uint64(0x9E3779B97F4A7C15)
+# Number of table rows, and of titles, processed at once by the vectorised
+# join (gathering title bytes needs several int64 temporaries per byte)
+_JOIN_CHUNK_SIZE = 2**20
+_TITLE_CHUNK_SIZE = 2**16
+
+
+def _gather_bytes(data, starts, lengths):
+    """
+    Concatenate the byte ranges of data with the given starts and lengths.
+    Returns the bytes, the position of each byte within its range and the
+    position of each range in the result.
+    """
+    range_starts = np.cumsum(lengths) - lengths
+    within = (np.arange(int(lengths.sum()), dtype=np.int64)
+              - np.repeat(range_starts, lengths))
+    return data[np.repeat(starts, lengths) + within], within, range_starts
+
+
+def _reduce_ranges(ufunc, values, range_starts, lengths, empty_value):
+    """
+    Apply ufunc.reduceat over consecutive ranges of values, giving empty_value
+    for empty ranges (which reduceat does not handle).
+    """
+    result = np.full(len(lengths), empty_value, dtype=values.dtype)
+    nonempty = lengths > 0
+    if values.size > 0:
+        result[nonempty] = ufunc.reduceat(values, range_starts[nonempty])
+    return result
+
+
+def title_hashes(column, rows):
+    """
+    Compute 64-bit hashes of the titles in the given rows of a TextColumn, as a
+    random linear function of their bytes.
+    """
+    data = column.byte_array()
+    result = np.empty(len(rows), dtype=np.uint64)
+    for i in range(0, len(rows), _TITLE_CHUNK_SIZE):
+        chunk = rows[i:i+_TITLE_CHUNK_SIZE]
+        starts = column.offsets[chunk]
+        lengths = column.offsets[chunk + 1] - starts
+        values, within, range_starts = _gather_bytes(data, starts, lengths)
+        products = (values.astype(np.uint64)
+                    * _TITLE_HASH_WEIGHTS[within % len(_TITLE_HASH_WEIGHTS)])
+        result[i:i+_TITLE_CHUNK_SIZE] = (
+            _reduce_ranges(np.add, products, range_starts, lengths, 0)
+            ^ (lengths.astype(np.uint64) * _TITLE_LENGTH_WEIGHT))
+    return result
+
+
+def _titles_equal(column_a, rows_a, column_b, rows_b):
+    """
+    Compare the titles in rows_a of one TextColumn with those in rows_b of
+    another, pairwise.
+    """
+    starts_a = column_a.offsets[rows_a]
+    starts_b = column_b.offsets[rows_b]
+    lengths = column_a.offsets[rows_a + 1] - starts_a
+    equal = lengths == column_b.offsets[rows_b + 1] - starts_b
+    candidates = np.nonzero(equal)[0]
+    data_a, data_b = column_a.byte_array(), column_b.byte_array()
+    for i in range(0, len(candidates), _TITLE_CHUNK_SIZE):
+        chunk = candidates[i:i+_TITLE_CHUNK_SIZE]
+        values_a, _, range_starts = _gather_bytes(data_a, starts_a[chunk],
+                                                  lengths[chunk])
+        values_b, _, _ = _gather_bytes(data_b, starts_b[chunk],
+                                       lengths[chunk])
+        equal[chunk] = ~_reduce_ranges(np.logical_or, values_a != values_b,
+                                       range_starts, lengths[chunk], False)
+    return equal
+
+
+class TitleLookup:
+    """
+    Sorted hashes of the titles in the rows of a TextColumn, for finding the
+    rows with given titles using binary search.
+    """
+    def __init__(self, column, rows):
+        hashes = title_hashes(column, rows)
+        order = np.argsort(hashes, kind='mergesort')
+        self.column = column
+        self.hashes = hashes[order]
+        self.rows = rows[order]
+
+    def find(self, column, rows):
+        """
+        For each of the given rows of another TextColumn, find the row with
+        the same title in this lookup's column, or -1 if there is none.
+        """
+        hashes = title_hashes(column, rows)
+        result = np.full(len(rows), -1, dtype=np.int64)
+        if len(self.hashes) == 0:
+            return result
+        positions = np.minimum(np.searchsorted(self.hashes, hashes),
+                               len(self.hashes) - 1)
+        found = np.nonzero(self.hashes[positions] == hashes)[0]
+        equal = _titles_equal(column, rows[found],
+                              self.column, self.rows[positions[found]])
+        result[found[equal]] = self.rows[positions[found[equal]]]
+        # Distinct titles with equal hashes: check the rest of the run
+        for i in found[~equal]:
+            position = positions[i] + 1
+            while (position < len(self.hashes)
+                   and self.hashes[position] == hashes[i]):
+                if column.raw(rows[i]) == self.column.raw(self.rows[position]):
+                    result[i] = self.rows[position]
+                    break
+                position += 1
+        return result
+
+
+def links_between_pages_vectorised(page_id_set, pagelinks_table_dir,
+                                   page_table_dir, redirect_table_dir,
+                                   page_lookup=None):
+    """
+    Produce the same graph of hyperlinks as links_between_pages from the tables
+    in columnar layout, joining pagelinks to pages and redirects on hashed
+    titles with sorted NumPy arrays instead of dicts keyed by title. A lookup
+    from main_page_lookup can be given to reuse it.
+
+    Returns the graph in CSR form as a tuple (ids, indptr, targets): the sorted
+    IDs of the given pages, and the array of linked page IDs in which those
+    linked from ids[i] are targets[indptr[i]:indptr[i+1]].
+    """
+    ids = np.array(sorted(page_id_set), dtype=np.int64)
+
+    # Select links from pages in the set (the table only holds links between
+    # main namespace pages)
+    pl_from = load_int_column(pagelinks_table_dir, 'pl_from')
+    link_rows = []
+    for i in range(0, len(pl_from), _JOIN_CHUNK_SIZE):
+        chunk = slice(i, i + _JOIN_CHUNK_SIZE)
+        selected = np.isin(pl_from[chunk], ids)
+        link_rows.append(np.nonzero(selected)[0] + i)
+    link_rows = np.concatenate(link_rows) if link_rows else np.zeros(
+        0, dtype=np.int64)
+    sources = np.asarray(pl_from[link_rows])
+
+    # Match linked titles to rows of the page table
+    page_ids = np.asarray(load_page_ids(page_table_dir))
+    page_is_redirect = np.asarray(
+        load_int_column(page_table_dir, 'page_is_redirect'))
+    if page_lookup is None:
+        page_lookup = main_page_lookup(page_table_dir)
+    linked_rows = page_lookup.find(
+        load_text_column(pagelinks_table_dir, 'pl_title'), link_rows)
+    found = linked_rows >= 0
+    sources, linked_rows = sources[found], linked_rows[found]
+    targets = page_ids[linked_rows]
+
+    # Replace links to redirects by links to their targets, dropping those
+    # without a valid (not double) redirect
+    via_redirect = page_is_redirect[linked_rows] == 1
+    if via_redirect.any():
+        rd_from = np.asarray(load_int_column(redirect_table_dir, 'rd_from'))
+        rd_rows = np.nonzero(np.asarray(
+            load_int_column(redirect_table_dir, 'rd_namespace')) == 0)[0]
+        rd_targets = page_lookup.find(
+            load_text_column(redirect_table_dir, 'rd_title'), rd_rows)
+        valid = rd_targets >= 0
+        valid[valid] = page_is_redirect[rd_targets[valid]] == 0
+        rd_sources = rd_from[rd_rows[valid]]
+        rd_target_ids = page_ids[rd_targets[valid]]
+        order = np.argsort(rd_sources, kind='mergesort')
+        rd_sources, rd_target_ids = rd_sources[order], rd_target_ids[order]
+
+        redirect_ids = targets[via_redirect]
+        resolved = np.full(len(redirect_ids), -1, dtype=np.int64)
+        if len(rd_sources) > 0:
+            positions = np.minimum(np.searchsorted(rd_sources, redirect_ids),
+                                   len(rd_sources) - 1)
+            hit = rd_sources[positions] == redirect_ids
+            resolved[hit] = rd_target_ids[positions[hit]]
+        targets[via_redirect] = resolved
+        keep = targets >= 0
+        sources, linked_rows, targets = (sources[keep], linked_rows[keep],
+                                         targets[keep])
+
+    # Order links by source, then by page table order of the linked title
+    order = np.lexsort((linked_rows, sources))
+    sources, targets = sources[order], targets[order]
+    counts = np.bincount(np.searchsorted(ids, sources), minlength=len(ids))
+    indptr = np.concatenate(([0], np.cumsum(counts)))
+    return ids, indptr, targets
+
+
+def csr_to_links(ids, indptr, targets):
+    """
+    Convert links in CSR form to the dict from page IDs to lists of linked page
+    IDs returned by links_between_pages.
+    """
+    targets = targets.tolist()
+    indptr = indptr.tolist()
+    return {id: targets[indptr[i]:indptr[i+1]]
+            for i, id in enumerate(ids.tolist())}
+
+
+# Start of each JSON line written by WikiExtractor, giving the page ID
+_EXTRACTED_ARTICLE_ID = re.compile(r'\{"id": "(\d+)"')
+# End of each JSON line written by WikiExtractor with --revision, giving the
+# revision ID
+_EXTRACTED_REVID = re.compile(r'"revid": "(\d+)"\}\s*$')
+
+# Identifies the tokenizer settings of tokenize_text in the token cache, change
+# whenever tokenize_text or _stopwords change
+TOKENIZER_VERSION = 'word_tokenize-lower-nopunct-stopwords-nltk{}'.format(
+    nltk.__version__)
+
+# Page IDs to tokenize and token cache in each worker process of
+# get_text_tokens
+_worker_page_id_set = None
+_worker_token_cache = None
+
+
+def _stopwords():
+    return set(stopwords.words('english')+['""', "''", '``', "'s"])
+
+
+def tokenize_text(text, sw):
+    """
+    Tokenize article text into lowercase tokens, dropping punctuation and the
+    given stopwords.
+    """
+    return [t.lower() for t in nltk.word_tokenize(text)
+                if t not in string.punctuation
+                and t.lower() not in sw]
+
+
+def extracted_article_id(line):
+    """
+    Get the page ID of an article in a line of WikiExtractor JSON output,
+    parsing the full JSON only if the line does not start with the ID.
+    """
+    match = _EXTRACTED_ARTICLE_ID.match(line)
+    if match is None:
+        return int(json.loads(line)['id'])
+    return int(match.group(1))
+
+
+def extracted_article_revid(line):
+    """
+    Get the revision ID of an article in a line of WikiExtractor JSON output,
+    or None if the text was extracted without --revision.
+    """
+    match = _EXTRACTED_REVID.search(line, max(0, len(line) - 64))
+    if match is None:
+        revid = json.loads(line).get('revid')
+        return None if revid is None else int(revid)
+    return int(match.group(1))
+
+
+def tokenize_extracted_file(filename, page_id_set, sw, token_cache=None):
+    """
+    Tokenize the text of the articles with given IDs in a single file of
+    WikiExtractor output, taking the tokens of article revisions found in the
+    token cache from there.
+
+    Returns the tokens by page ID and the revision IDs of the pages that were
+    tokenized (None for pages without a revision ID).
+    """
+    ids_to_tokens = {}
+    tokenized_revids = {}
+    for line in open(filename, "r", encoding='utf8'):
+        id = extracted_article_id(line)
+        if id not in page_id_set:
+            continue
+        revid = None
+        if token_cache is not None:
+            revid = extracted_article_revid(line)
+            if revid is not None and token_cache.contains(id, revid):
+                ids_to_tokens[id] = token_cache.get(id, revid)
+                continue
+        entry = json.loads(line)
+        ids_to_tokens[id] = tokenize_text(entry['text'], sw)
+        tokenized_revids[id] = revid
+    return ids_to_tokens, tokenized_revids
+
+
+def _init_tokenizer_worker(page_id_set, token_cache_dir, token_cache_index):
+    global _worker_page_id_set, _worker_token_cache
+    _worker_page_id_set = page_id_set
+    if token_cache_dir is not None:
+        # Share the index the parent built for the pages in the set rather
+        # than scanning the whole cache in every worker
+        _worker_token_cache = TokenCache(token_cache_dir, TOKENIZER_VERSION,
+                                         readonly=True,
+                                         index=token_cache_index)
+
+
+def _tokenize_file_in_worker(filename):
+    return tokenize_extracted_file(filename, _worker_page_id_set, _stopwords(),
+                                   _worker_token_cache)
+
+
+def get_text_tokens(page_id_set, text_extractor_data_dir, processes=None,
+                    token_cache_dir=None):
     """
     Process extracted text data to get tokenized text for pages with given IDs.
+    The extracted files are tokenized in parallel by the given number of
+    processes (all CPUs by default).
+
+    If token_cache_dir is given, tokens are cached there by page ID and
+    revision ID, so that pages already tokenized by a previous run are not
+    tokenized again. This requires text extracted with WikiExtractor's
+    --revision option.
     """
+    filenames = [os.path.join(root, file)
+                 for root, dirs, files in os.walk(text_extractor_data_dir)
+                 for file in sorted(files)]
+    token_cache = None
+    if token_cache_dir is not None:
+        token_cache = TokenCache(token_cache_dir, TOKENIZER_VERSION,
+                                 page_ids=page_id_set)
+        print(datetime.now().strftime('%H:%M:%S'), 'Token cache has',
+              len(token_cache), 'of the pages')
+
+    if processes == 1:
+        sw = _stopwords()
+        results = (tokenize_extracted_file(filename, page_id_set, sw,
+                                           token_cache)
+                   for filename in filenames)
+        pool = None
+    else:
+        pool = Pool(processes, initializer=_init_tokenizer_worker,
+                    initargs=(page_id_set, token_cache_dir,
+                              None if token_cache is None
+                              else token_cache.index))
+        results = pool.imap(_tokenize_file_in_worker, filenames, chunksize=4)
+
     ids_to_tokens = {}
-    sw = stopwords.words('english')+['""', "''", '``', "'s"]
-    for root, dirs, files in os.walk(text_extractor_data_dir):
-        for file in files:
-            for line in open(os.path.join(root, file), "r", encoding='utf8'):
-                entry = json.loads(line)
-                id = int(entry['id'])
-                if id in page_id_set:
-                    ids_to_tokens[id] = (
-                        [t.lower() for t in nltk.word_tokenize(entry['text'])
-                            if t not in string.punctuation
-                            and t.lower() not in sw]
-                    )
+    hits = misses = without_revid = 0
+    try:
+        for file_tokens, tokenized_revids in results:
+            ids_to_tokens.update(file_tokens)
+            hits += len(file_tokens) - len(tokenized_revids)
+            for id, revid in tokenized_revids.items():
+                if revid is None:
+                    without_revid += 1
+                else:
+                    misses += 1
+                    if token_cache is not None:
+                        token_cache.add(id, revid, file_tokens[id])
+    finally:
+        if pool is not None:
+            pool.terminate()
+        if token_cache is not None:
+            token_cache.close()
+
+    if token_cache is not None:
+        print(datetime.now().strftime('%H:%M:%S'), 'Token cache:', hits,
+              'hits,', misses, 'misses,', without_revid,
+              'pages without revision ID')
     return ids_to_tokens
 
 
 def load_with_multiple_label_maps(label_mapping_list, page2cat_filename,
                                 page_table_filename, pagelinks_table_filename,
                                 redirect_table_filename, text_extractor_data,
-                                output_dir=None, output_names=None):
+                                output_dir=None, output_names=None,
+                                token_cache_dir=None):
     """
     Extract muliple datasets defined by mapping sets of categories to labels.
 
     Each dataset is defined by a list of labels with categories corresponding to
     each label. The source files are read only once to load all data relevant
-    for all label mappings, then output each dataset to a .pickle file as a map
-    from node IDs to node objects, location given by output_dir.
+    for all label mappings, then output each dataset to a dataset store (see
+    dataset_store.py) holding a map from node IDs to node objects, location
+    given by output_dir.
 
     If the output_dir parameter is not given, the function returns the results
     without saving them to file.
 
     Optionally output_names can be given to name each dataset, otherwise they
-    will be numbered.
+    will be numbered. Tokenized text is cached in token_cache_dir if given.
     """
     # Get titles to mapped to labels for each label dataset
     print(datetime.now().strftime('%H:%M:%S'), 'Loading page titles for labels...')
@@ -182,19 +652,37 @@ def load_with_multiple_label_maps(label_mapping_list, page2cat_filename,
     print(datetime.now().strftime('%H:%M:%S'), 'Mapping titles to page IDs...')
     all_titles = set([]).union(*[titles_to_labels.keys()
                                 for titles_to_labels in multi_titles_to_labels])
-    all_titles_to_ids = page_titles_to_ids(all_titles, page_table_filename)
+    # Tables in columnar layout are joined on title hashes, CSVs through a
+    # dict-based index of all pages
+    columnar = os.path.isdir(pagelinks_table_filename)
+    if columnar:
+        page_lookup = main_page_lookup(page_table_filename)
+        all_titles_to_ids = page_titles_to_ids_columnar(
+            all_titles, page_lookup, page_table_filename)
+    else:
+        page_index = PageIndex.load(page_table_filename)
+        all_titles_to_ids = page_titles_to_ids(all_titles, page_index)
     all_ids_to_titles = {v:k for (k,v) in all_titles_to_ids.items()}
     all_ids = set(all_titles_to_ids.values())
 
     # Load link and text data
     print(datetime.now().strftime('%H:%M:%S'), 'Loading links between pages...')
-    all_links = links_between_pages(
-        all_ids, pagelinks_table_filename,
-        page_table_filename, redirect_table_filename
-    )
+    if columnar:
+        all_links = csr_to_links(*links_between_pages_vectorised(
+            all_ids, pagelinks_table_filename,
+            page_table_filename, redirect_table_filename, page_lookup
+        ))
+        del page_lookup
+    else:
+        all_links = links_between_pages(
+            all_ids, pagelinks_table_filename,
+            page_index, redirect_table_filename
+        )
+        del page_index
 
     print(datetime.now().strftime('%H:%M:%S'), 'Loading and tokenizing text...')
-    all_ids_to_tokens = get_text_tokens(all_ids, text_extractor_data)
+    all_ids_to_tokens = get_text_tokens(all_ids, text_extractor_data,
+                                         token_cache_dir=token_cache_dir)
 
     # Get ID sets of valid pages with no data missing for each individual dataset
     print(datetime.now().strftime('%H:%M:%S'), 'Filtering IDs...')
@@ -212,6 +700,7 @@ def load_with_multiple_label_maps(label_mapping_list, page2cat_filename,
 
     # Create datasets as a list of sets of Node objects
     print(datetime.now().strftime('%H:%M:%S'), 'Creating final sets...')
+    vocab = Vocabulary()
     result = [
         {
             id: WikiDataNode(
@@ -220,7 +709,8 @@ def load_with_multiple_label_maps(label_mapping_list, page2cat_filename,
                 multi_titles_to_labels[i][all_ids_to_titles[id]],
                 [out_id for out_id in all_valid_links[id]
                     if out_id in id_sets[i]],
-                all_ids_to_tokens[id]
+                all_ids_to_tokens[id],
+                vocab
             )
             for id in id_sets[i]
         }
@@ -230,17 +720,13 @@ def load_with_multiple_label_maps(label_mapping_list, page2cat_filename,
     if output_dir is not None:
         if output_names is not None:
             for name in output_names:
-                os.mkdir(os.path.join(output_dir, name))
+                os.makedirs(os.path.join(output_dir, name), exist_ok=True)
         print(datetime.now().strftime('%H:%M:%S'), 'Writing to file...')
         for i in range(len(result)):
             print(datetime.now().strftime('%H:%M:%S'),
                 'Writing dataset', i, '...')
-            out_filename = (os.path.join(output_dir, 'ds_'+str(i))
-                if output_names is None
-                else os.path.join(output_dir, output_names[i],
-                                    'fulldata.pickle'))
-            with open(out_filename, 'wb') as output:
-                pickle.dump(result[i], output, -1)
+            save_dataset(result[i], os.path.join(output_dir,
+                'ds_'+str(i) if output_names is None else output_names[i]))
     return result
 
 
@@ -254,10 +740,11 @@ def load_single_dataset(label_mapping, page2cat_filename, page_table_filename,
 def extract_by_single_mapping_file(mappings_filename, page2cat_filename,
                             page_table_filename, pagelinks_table_filename,
                             redirect_table_filename, text_extractor_data,
-                            output_dir):
+                            output_dir, token_cache_dir=None):
     """
     Extract a single dataset based on a label mapping specified in the given
-    JSON file. The result will be written to output_dir/fulldata.pickle.
+    JSON file. The result will be written to the dataset store in
+    output_dir/fulldata.
     """
     with open(mappings_filename, 'r') as file:
         mapping = json.load(file)
@@ -265,14 +752,15 @@ def extract_by_single_mapping_file(mappings_filename, page2cat_filename,
         [mapping], page2cat_filename, page_table_filename,
         pagelinks_table_filename, redirect_table_filename, text_extractor_data,
         os.path.dirname(os.path.normpath(output_dir)),
-        [os.path.basename(os.path.normpath(output_dir))]
+        [os.path.basename(os.path.normpath(output_dir))],
+        token_cache_dir
     )
 
 
 def extract_by_multiple_mappings_file(mappings_filename, page2cat_filename,
                             page_table_filename, pagelinks_table_filename,
                             redirect_table_filename, text_extractor_data,
-                            output_dir):
+                            output_dir, token_cache_dir=None):
     """
     Load datasets based on label mappings specified in a JSON file storing with
     the top level object mapping dataset names to label mappings.
@@ -287,7 +775,7 @@ def extract_by_multiple_mappings_file(mappings_filename, page2cat_filename,
     load_with_multiple_label_maps(
         mapping_list, page2cat_filename, page_table_filename,
         pagelinks_table_filename, redirect_table_filename, text_extractor_data,
-        output_dir, names
+        output_dir, names, token_cache_dir
     )
 
 
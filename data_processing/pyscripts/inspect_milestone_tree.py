@@ -3,60 +3,119 @@ Calculate stats about hierarchy of selected milestone categories and print the
 tree hierarchy structure.
 """
 import csv
+import os
 import sys
 import json
-import re
-import pandas as pd
+import argparse
+from collections import Counter
+from datetime import datetime
+from multiprocessing import Pool
 
-def get_category_sizes(page2cat_filename, output_filename=None):
+def split_at_lines(filename, n_chunks):
     """
-    Calculates how many pages are mapped to each category, optionally outputting
-    as a CSV file besides returning it as a dictionary.
+    Split a file into at most n_chunks byte ranges of roughly equal size, each
+    starting at the beginning of a line. Returns a list of (start, end)
+    offsets covering the whole file.
+    """
+    size = os.path.getsize(filename)
+    boundaries = [0]
+    with open(filename, 'rb') as f:
+        for i in range(1, n_chunks):
+            offset = max(size * i // n_chunks, boundaries[-1])
+            if offset > 0:
+                f.seek(offset - 1)
+                offset += len(f.readline()) - 1
+            if offset > boundaries[-1] and offset < size:
+                boundaries.append(offset)
+    boundaries.append(size)
+    return list(zip(boundaries[:-1], boundaries[1:]))
+
+
+def _lines_in_range(f, length):
+    """
+    Iterate over the lines of a binary file from its current position until
+    length bytes have been read.
+    """
+    for line in f:
+        if length <= 0:
+            break
+        length -= len(line)
+        yield line
+
+
+def count_categories_in_range(task):
     """
+    Count the pages mapped to each category in one byte range of a page2cat
+    file. Takes a single (filename, start, end) tuple so that it can be mapped
+    over a process pool. Categories are counted as UTF-8 bytes and decoded
+    once when the counts are merged.
+    """
+    filename, start, end = task
+    counts = Counter()
+    with open(filename, 'rb') as f:
+        f.seek(start)
+        for line in _lines_in_range(f, end - start):
+            # Page title followed by tab-terminated categories
+            counts.update(cat for cat in line.rstrip(b'\r\n').split(b'\t')[1:]
+                          if cat)
+    return counts
+
 
-    def file_len(fname):
-        with open(fname) as f:
-            for i, l in enumerate(f):
-                pass
-        return i + 1
-
-    counts = {}
-    idx = 0
-    for line in open(page2cat_filename, encoding='utf8'):
-        titles = re.split(r'\t+', line)
-        for i in range(1, len(titles)-1):
-            title = titles[i]
-            counts[title] = counts.get(title, 0) + 1
-        idx += 1
-        if idx % 100000 == 0:
-            print(idx, 'pages counted')
+def get_category_sizes(page2cat_filename, output_filename=None,
+                       processes=None):
+    """
+    Calculates how many pages are mapped to each category, optionally outputting
+    as a CSV file besides returning it as a dictionary. The file is split into
+    byte ranges counted in parallel by the given number of processes (all CPUs
+    by default).
+    """
+    processes = processes or os.cpu_count() or 1
+    ranges = split_at_lines(page2cat_filename, processes * 4)
+    tasks = [(page2cat_filename, start, end) for start, end in ranges]
+
+    merged = Counter()
+    with Pool(processes) as pool:
+        for i, partial in enumerate(pool.imap(count_categories_in_range,
+                                              tasks)):
+            merged.update(partial)
+            print(datetime.now().strftime('%H:%M:%S'),
+                  'Counted part {} of {}'.format(i + 1, len(tasks)))
+    counts = {cat.decode('utf-8'): n for cat, n in merged.items()}
 
     print('Counted', len(counts), 'category sizes')
     if output_filename is not None:
-        df = pd.DataFrame([{'category': k, 'pages': v} for (k,v) in counts.items()])
-        df = df.sort_values(by='pages', ascending=False)
-        df.to_csv(FILE_OUT, sep='\t', encoding='utf-8', index=False)
+        with open(output_filename, 'w', encoding='utf-8', newline='') as out:
+            writer = csv.writer(out, delimiter='\t')
+            writer.writerow(['category', 'pages'])
+            writer.writerows(sorted(counts.items(), key=lambda x: x[1],
+                                    reverse=True))
 
     return counts
 
 
 def calculate_milestone_tree(subcats_filename, sizes_filename=None,
-                            page2cat_filename=None, out_filename=None):
+                            page2cat_filename=None, out_filename=None,
+                            category_sizes=None, processes=None):
     """
     Builds a tree based on the category parent relations, and calculates
-    statistics for subtrees.
+    statistics for subtrees. Category sizes are given directly as a dictionary
+    (as returned by get_category_sizes), read from a precomputed sizes file or
+    counted from the page2cat file.
     """
     raw_sizes = {}
     parent = {}
     children = {}
     roots = []
 
-    if sizes_filename is None and page2cat_filename is None:
+    if (category_sizes is None and sizes_filename is None
+            and page2cat_filename is None):
         print('Error, give precomputed sizes or page2cat file')
         return None
 
-    if sizes_filename is None:
-        raw_sizes = get_category_sizes(page2cat_filename)
+    if category_sizes is not None:
+        raw_sizes = category_sizes
+    elif sizes_filename is None:
+        raw_sizes = get_category_sizes(page2cat_filename, processes=processes)
     else:
         with open(sizes_filename) as size_file:
             reader = csv.reader(size_file, delimiter='\t')
@@ -132,5 +191,21 @@ def print_tree(root, milestone_tree, output=sys.stdout, indent_level=0):
 
 
 if __name__ == '__main__':
-    calculate_milestone_tree(sys.argv[1], page2cat_filename=sys.argv[2],
-                                out_filename=sys.argv[3])
+    parser = argparse.ArgumentParser(
+        description='Print the milestone category tree with subtree sizes')
+    parser.add_argument('subcats_filename',
+        help='TSV file of milestone categories and their parents')
+    parser.add_argument('page2cat_filename',
+        help='TSV file mapping pages to sanitized categories')
+    parser.add_argument('out_filename', help='File to print the tree to')
+    parser.add_argument('--sizes-output',
+        help='Also write the category sizes to this TSV file')
+    parser.add_argument('--processes', type=int,
+        help='Number of processes counting category sizes (default: number '
+             'of CPUs)')
+    args = parser.parse_args()
+
+    sizes = get_category_sizes(args.page2cat_filename, args.sizes_output,
+                               args.processes)
+    calculate_milestone_tree(args.subcats_filename, category_sizes=sizes,
+                             out_filename=args.out_filename)
@@ -2,12 +2,13 @@
 Sample a set of pages from each class for interactive inspection by the user
 and write the inspection results to file.
 """
-import pickle
+import sys
 import os
 import json
 import random
 
 import process_dataset
+from dataset_store import load_dataset
 
 def print_node_data(node, all_nodes_map):
     """Print details of a single page."""
@@ -26,9 +27,7 @@ def sample_and_validate(dataset_dir, sample_count=20):
     ask user to evaluate correctness of labels, write results to file in that
     directory.
     """
-    nodes = pickle.load(
-        open(os.path.join(dataset_dir, 'fulldata.pickle'), 'rb')
-    )
+    nodes = load_dataset(dataset_dir)
     labels = process_dataset.label_set(nodes)
     nodes_for_labels = {lab:[] for lab in labels}
     verdicts = {}
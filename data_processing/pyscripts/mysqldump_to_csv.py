@@ -4,8 +4,21 @@ https://github.com/jamesmishra/mysqldump-to-csv.
 """
 #!/usr/bin/env python
 import fileinput
+import itertools
+import operator
 import csv
+import re
 import sys
+import os
+import io
+import gzip
+import bz2
+import queue
+import shutil
+import subprocess
+import threading
+import time
+from datetime import datetime
 
 # This prevents prematurely closed pipes from raising
 # an exception in Python
@@ -16,10 +29,161 @@ if sys.platform != 'win32':
 # allow large content in the dump
 csv.field_size_limit(2**31-1)
 
+# Byte patterns used by iter_rows. A row is a parenthesised list of columns,
+# each either a quoted string (possibly containing escaped characters) or a
+# bare NULL or number.
+_QUOTED_COLUMN = rb"'[^'\\]*(?:\\.[^'\\]*)*'"
+_COLUMN = rb"(?:" + _QUOTED_COLUMN + rb"|[^,)'(]*)"
+_ROW = re.compile(rb"\((" + _COLUMN + rb"(?:," + _COLUMN + rb")*)\)",
+                  re.DOTALL)
+# Empty string column in rows joined by newlines
+_EMPTY_COLUMN = re.compile(rb"(?<![^,\n])''(?![^,\n])")
+# Number of rows decoded at once by iter_rows
+_DECODE_BATCH_ROWS = 4096
+# Column definitions in a CREATE TABLE statement, e.g. "  `page_id` int(8) ..."
+_COLUMN_DEFINITION = re.compile(rb"\s*`([^`]+)`\s")
+
+# Size of the read buffer for dumps, and of the chunks handed over by
+# background decompression.
+READ_BUFFER_SIZE = 16 * 2**20
+# Default size of the buffer for converted output
+WRITE_BUFFER_SIZE = 8 * 2**20
+
+# Modules and command line tools (fastest first) for compressed dumps
+COMPRESSED_FORMATS = {
+    '.gz': (gzip, [['pigz', '-dc'], ['gzip', '-dc']]),
+    '.bz2': (bz2, [['lbzip2', '-dc'], ['pbzip2', '-dc'], ['bzip2', '-dc']]),
+}
+
+
+class _ThreadedReader(io.RawIOBase):
+    """
+    Raw binary stream reading chunks of another file object in a background
+    thread, so that decompression (which releases the GIL) overlaps with the
+    consumer's work.
+    """
+    def __init__(self, fileobj, chunk_size=READ_BUFFER_SIZE, max_chunks=4):
+        super().__init__()
+        self._chunks = queue.Queue(max_chunks)
+        self._stopped = threading.Event()
+        self._pending = memoryview(b'')
+        self._eof = False
+        self._thread = threading.Thread(target=self._fill,
+                                        args=(fileobj, chunk_size),
+                                        daemon=True)
+        self._thread.start()
+
+    def _fill(self, fileobj, chunk_size):
+        try:
+            with fileobj:
+                while not self._stopped.is_set():
+                    chunk = fileobj.read(chunk_size)
+                    self._put(chunk)
+                    if not chunk:
+                        break
+        except Exception as e:
+            self._put(e)
+
+    def _put(self, item):
+        while not self._stopped.is_set():
+            try:
+                self._chunks.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                pass
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        if not self._pending:
+            if self._eof:
+                return 0
+            chunk = self._chunks.get()
+            if isinstance(chunk, Exception):
+                raise chunk
+            if not chunk:
+                self._eof = True
+                return 0
+            self._pending = memoryview(chunk)
+        n = min(len(buffer), len(self._pending))
+        buffer[:n] = self._pending[:n]
+        self._pending = self._pending[n:]
+        return n
+
+    def close(self):
+        self._stopped.set()
+        super().close()
+
+
+class _ProcessReader(io.RawIOBase):
+    """
+    Raw binary stream over the output of a decompression command run in a
+    separate process.
+    """
+    def __init__(self, command, input_filename):
+        super().__init__()
+        self._process = subprocess.Popen(command + [input_filename],
+                                         stdout=subprocess.PIPE)
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        return self._process.stdout.readinto(buffer)
+
+    def close(self):
+        if not self.closed:
+            self._process.stdout.close()
+            # A negative status means the process was killed by a signal,
+            # e.g. SIGPIPE when the dump is closed before reaching its end.
+            if self._process.wait() > 0:
+                raise IOError('{} exited with status {}'.format(
+                    ' '.join(self._process.args), self._process.returncode))
+        super().close()
+
+
+def open_dump(input_filename, decompress='inline'):
+    """
+    Open a dump for reading as a buffered binary file. Dumps ending in .gz or
+    .bz2 are decompressed on the fly, either inline, in a background thread
+    ('thread') or by a command line tool in a separate process ('process').
+    """
+    extension = os.path.splitext(input_filename)[1]
+    if extension not in COMPRESSED_FORMATS:
+        return open(input_filename, 'rb', buffering=READ_BUFFER_SIZE)
+    module, commands = COMPRESSED_FORMATS[extension]
+    if decompress == 'inline':
+        return io.BufferedReader(module.open(input_filename, 'rb'),
+                                 READ_BUFFER_SIZE)
+    if decompress == 'thread':
+        return io.BufferedReader(
+            _ThreadedReader(module.open(input_filename, 'rb')),
+            READ_BUFFER_SIZE)
+    if decompress == 'process':
+        for command in commands:
+            if shutil.which(command[0]) is not None:
+                return io.BufferedReader(
+                    _ProcessReader(command, input_filename), READ_BUFFER_SIZE)
+        raise ValueError('None of {} found for decompressing {}'.format(
+            [command[0] for command in commands], input_filename))
+    raise ValueError('Unknown decompression mode {}'.format(decompress))
+
+
+def is_compressed(input_filename):
+    """
+    Returns true if the dump is compressed, and so cannot be read at arbitrary
+    byte offsets.
+    """
+    return os.path.splitext(input_filename)[1] in COMPRESSED_FORMATS
+
 def is_insert(line):
     """
-    Returns true if the line begins a SQL insert statement.
+    Returns true if the line begins a SQL insert statement. Accepts both str and
+    bytes lines.
     """
+    if isinstance(line, bytes):
+        return line.startswith(b'INSERT INTO')
     return line.startswith('INSERT INTO') or False
 
 
@@ -27,6 +191,8 @@ def get_values(line):
     """
     Returns the portion of an INSERT statement containing values
     """
+    if isinstance(line, bytes):
+        return line.partition(b'` VALUES ')[2]
     return line.partition('` VALUES ')[2]
 
 
@@ -35,7 +201,7 @@ def values_sanity_check(values):
     Ensures that values from the INSERT statement meet basic checks.
     """
     assert values
-    assert values[0] == '('
+    assert values[:1] in ('(', b'(')
     # Assertions have not been raised
     return True
 
@@ -98,20 +264,221 @@ def parse_values(values, outfile):
             writer.writerow(latest_row)
 
 
-def dump_to_csv(input_filename, output_filename):
+def _decode_rows(rows):
+    text = b'\n'.join(rows)
+    if b"''" in text:
+        text = _EMPTY_COLUMN.sub(b'NULL', text)
+    reader = csv.reader(text.decode('utf-8', errors='replace').split('\n'),
+                        delimiter=',',
+                        doublequote=False,
+                        escapechar='\\',
+                        quotechar="'",
+                        strict=True
+    )
+    return map(tuple, reader)
+
+
+def _check_rows_cover(values, rows):
     """
-    Parse arguments and start the program
+    Raise a ValueError if the rows matched in the values of an INSERT statement
+    do not account for all of its bytes, i.e. some text was skipped because it
+    does not match the row pattern.
     """
-    try:
-        for line in open(input_filename, encoding='utf-8', errors='replace'):
+    # Each row is wrapped in parentheses and followed by a comma or semicolon
+    covered = sum(map(len, rows)) + 3 * len(rows)
+    if covered <= len(values) and not values[covered:].strip():
+        return
+    position = 0
+    for match in _ROW.finditer(values):
+        if match.start() != position:
+            break
+        position = match.end() + 1
+    raise ValueError('Cannot parse INSERT values at byte {}: {!r}'.format(
+        position, values[position:position + 80]))
+
+
+def iter_rows(values):
+    """
+    Given the raw bytes of the values from a MySQL INSERT statement, return an
+    iterator over its rows as tuples of column strings, equivalent to the rows
+    parse_values writes.
+
+    Row boundaries are found by matching the bytes against a regular expression
+    for a complete tuple, so quotes, escapes and parentheses inside strings are
+    handled without decoding the whole statement. Batches of rows are then
+    joined by newlines (which only occur escaped inside a statement), decoded
+    at once and split into columns by the csv module. Empty strings are turned
+    into NULL beforehand, as parse_values does. A ValueError is raised if any
+    text of the statement is not part of a row.
+    """
+    rows = _ROW.findall(values)
+    _check_rows_cover(values, rows)
+    return itertools.chain.from_iterable(
+        _decode_rows(rows[i:i + _DECODE_BATCH_ROWS])
+        for i in range(0, len(rows), _DECODE_BATCH_ROWS))
+
+
+def get_column_names(input_filename):
+    """
+    Returns the column names of the table in a dump, read from the CREATE TABLE
+    statement preceding the first INSERT statement.
+    """
+    names = []
+    with open_dump(input_filename) as dump:
+        in_create_table = False
+        for line in dump:
+            if is_insert(line):
+                break
+            if line.startswith(b'CREATE TABLE'):
+                in_create_table = True
+            elif in_create_table:
+                if line.startswith(b')'):
+                    break
+                match = _COLUMN_DEFINITION.match(line)
+                if match is not None:
+                    names.append(match.group(1).decode('utf-8'))
+    return names
+
+
+def column_indices(input_filename, columns):
+    """
+    Turn a list of column names and/or indices into indices into the rows of
+    the given dump.
+    """
+    names = None
+    indices = []
+    for column in columns:
+        if isinstance(column, str):
+            if names is None:
+                names = get_column_names(input_filename)
+            if column not in names:
+                raise ValueError('No column {} in table dump {}'.format(
+                    column, input_filename))
+            column = names.index(column)
+        indices.append(column)
+    return indices
+
+
+def select_rows(values, row_filter=None, columns=None):
+    """
+    Returns an iterator over the rows of an INSERT statement that pass
+    row_filter (a function from a full row tuple to a bool), each reduced to
+    the columns at the given indices.
+    """
+    rows = iter_rows(values)
+    if row_filter is not None:
+        rows = filter(row_filter, rows)
+    if columns is not None:
+        if len(columns) == 1:
+            rows = ((row[columns[0]],) for row in rows)
+        else:
+            rows = map(operator.itemgetter(*columns), rows)
+    return rows
+
+
+class ConversionProgress:
+    """
+    Count the statements, rows and bytes of INSERT values converted from a dump
+    and print the totals and throughput at most every interval seconds. No
+    progress is printed if interval is None.
+    """
+    def __init__(self, interval=30):
+        self.interval = interval
+        self.statements = 0
+        self.rows = 0
+        self.bytes = 0
+        self.start_time = self.last_report = time.time()
+
+    def update(self, n_bytes, n_rows):
+        self.statements += 1
+        self.rows += n_rows
+        self.bytes += n_bytes
+        if self.interval is not None:
+            now = time.time()
+            if now - self.last_report >= self.interval:
+                self.report(now)
+
+    def report(self, now=None):
+        if now is None:
+            now = time.time()
+        self.last_report = now
+        elapsed = max(now - self.start_time, 1e-9)
+        print(datetime.now().strftime('%H:%M:%S'),
+              '{:,} statements, {:,} rows written, {:.1f} MB/s'.format(
+                  self.statements, self.rows, self.bytes / 2**20 / elapsed))
+
+
+def iter_statements(input_filename, start=0, end=None, decompress='inline'):
+    """
+    Yield the raw values of each INSERT statement in a dump. Optionally only
+    the statements in the byte range [start, end) are read, with start at the
+    beginning of a line; this is not supported for compressed dumps, see
+    open_dump for the decompress modes.
+    """
+    if is_compressed(input_filename) and (start > 0 or end is not None):
+        raise ValueError('Cannot read a byte range of compressed dump '
+                         + input_filename)
+    with open_dump(input_filename, decompress) as dump:
+        if start > 0:
+            dump.seek(start)
+        position = start
+        for line in dump:
+            if end is not None and position >= end:
+                break
+            position += len(line)
             # Look for an INSERT statement and parse it.
             if is_insert(line):
                 values = get_values(line)
                 if values_sanity_check(values):
-                    parse_values(values, open(output_filename, 'a+',
-                        encoding='utf-8', newline=''))
+                    yield values
+
+
+def dump_to_csv(input_filename, output_filename, row_filter=None,
+                columns=None, start=0, end=None, decompress='inline',
+                write_buffer_size=WRITE_BUFFER_SIZE, progress_interval=30):
+    """
+    Convert the INSERT statements of a dump to CSV, appended to the output file
+    through a single buffered writer. Only rows for which row_filter returns
+    true are written, and only the given columns (names or indices) of those.
+    See iter_statements for start, end and decompress, and ConversionProgress
+    for progress_interval.
+    """
+    if columns is not None:
+        columns = column_indices(input_filename, columns)
+    progress = ConversionProgress(progress_interval)
+    outfile = open(output_filename, 'a', encoding='utf-8', newline='',
+                   buffering=write_buffer_size)
+    try:
+        writer = csv.writer(outfile, quoting=csv.QUOTE_MINIMAL)
+        first = operator.itemgetter(0)
+        for values in iter_statements(input_filename, start, end, decompress):
+            # Rows are streamed to the writer, counted by how far they
+            # advance counter (zip stops before advancing it past the end)
+            counter = itertools.count()
+            writer.writerows(map(first, zip(
+                select_rows(values, row_filter, columns), counter)))
+            progress.update(len(values), next(counter))
+        outfile.flush()
     except KeyboardInterrupt:
         sys.exit(0)
+    finally:
+        outfile.close()
+    if progress_interval is not None:
+        progress.report()
+    return progress
+
+
+def legacy_dump_to_csv(input_filename, output_filename):
+    """
+    Convert a dump using the original csv-module based parse_values. Kept as a
+    reference for benchmark_mysqldump_to_csv.py.
+    """
+    for line in open(input_filename, encoding='utf-8', errors='replace'):
+        if is_insert(line):
+            values = get_values(line)
+            if values_sanity_check(values):
+                parse_values(values, open(output_filename, 'a+',
+                    encoding='utf-8', newline=''))
 
 if __name__ == "__main__":
     dump_to_csv(sys.argv[1], sys.argv[2])
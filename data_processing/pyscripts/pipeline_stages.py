@@ -0,0 +1,90 @@
+"""
+Checkpointing of data pipeline stages: each stage records a hash of its inputs
+and parameters in the output directory, so that reruns can skip stages whose
+inputs are unchanged.
+
+Input files up to CONTENT_HASH_LIMIT bytes are hashed by content, larger ones
+(the preprocessed dumps) are identified by size and modification time, as
+hashing tens of gigabytes would take longer than some of the stages. Input
+directories (the extracted texts, columnar tables) are identified by the
+relative path, size and modification time of each file they contain, so that
+checking them does not read the whole corpus.
+"""
+import hashlib
+import json
+import os
+
+STAGES_FILENAME = 'stages.json'
+CONTENT_HASH_LIMIT = 64*2**20
+_READ_SIZE = 2**20
+
+
+def _update_with_stat(hasher, stat):
+    hasher.update('{} {}\n'.format(stat.st_size,
+                                   stat.st_mtime_ns).encode('utf-8'))
+
+
+def _update_with_file(hasher, filename):
+    stat = os.stat(filename)
+    if stat.st_size > CONTENT_HASH_LIMIT:
+        _update_with_stat(hasher, stat)
+        return
+    with open(filename, 'rb') as f:
+        for block in iter(lambda: f.read(_READ_SIZE), b''):
+            hasher.update(block)
+
+
+def _update_with_path(hasher, path):
+    if not os.path.isdir(path):
+        _update_with_file(hasher, path)
+        return
+    for root, dirs, files in os.walk(path):
+        dirs.sort()
+        for file in sorted(files):
+            filename = os.path.join(root, file)
+            hasher.update(os.path.relpath(filename, path).encode('utf-8')
+                          + b'\n')
+            _update_with_stat(hasher, os.stat(filename))
+
+
+def stage_digest(input_paths, parameters):
+    """
+    Hash the given input files or directories and parameters (JSON
+    serialisable) of a stage.
+    """
+    hasher = hashlib.sha256()
+    for path in input_paths:
+        hasher.update(path.encode('utf-8') + b'\n')
+        _update_with_path(hasher, path)
+    hasher.update(json.dumps(parameters, sort_keys=True).encode('utf-8'))
+    return hasher.hexdigest()
+
+
+def _load_stages(output_dir):
+    try:
+        with open(os.path.join(output_dir, STAGES_FILENAME)) as file:
+            return json.load(file)
+    except FileNotFoundError:
+        return {}
+
+
+def stage_is_current(output_dir, stage, digest, outputs):
+    """
+    Check whether a stage was last completed in output_dir with inputs
+    hashing to digest and its output files still exist there.
+    """
+    return (_load_stages(output_dir).get(stage) == digest
+            and all(os.path.exists(os.path.join(output_dir, output))
+                    for output in outputs))
+
+
+def record_stage(output_dir, stage, digest):
+    """
+    Record that a stage completed in output_dir with inputs hashing to digest.
+    """
+    stages = _load_stages(output_dir)
+    stages[stage] = digest
+    tmp_filename = os.path.join(output_dir, STAGES_FILENAME + '.tmp')
+    with open(tmp_filename, 'w') as file:
+        json.dump(stages, file, indent=2)
+    os.replace(tmp_filename, os.path.join(output_dir, STAGES_FILENAME))
@@ -1,51 +1,325 @@
 """
 Preprocess the 'page', 'redirect' and 'pagelinks' table SQL dumps by turning
-them into CSVs and filtering for only the entries relating to the default
-namespace.
+them into CSVs of the columns used downstream, filtered for only the entries
+relating to the default namespace.
+
+Alternatively the tables can be written in a memory-mappable columnar layout,
+one directory per table with a file per column:
+- integer columns as int64 NumPy arrays (<column>.npy)
+- text columns as the concatenated UTF-8 bytes of all values (<column>.bytes)
+    and an int64 NumPy array of n+1 offsets into them (<column>.offsets.npy)
 """
 import sys
-import csv
 import os
+import shutil
 import argparse
+import functools
+import contextlib
+import time
+from datetime import datetime
+from multiprocessing import Pool
+
+import numpy as np
+
+from mysqldump_to_csv import (dump_to_csv, column_indices, get_column_names,
+                              iter_statements, select_rows, is_insert,
+                              is_compressed, ConversionProgress,
+                              COMPRESSED_FORMATS, WRITE_BUFFER_SIZE)
+
+# For each table, the indices of the namespace fields that must be 0 and the
+# columns kept in the output CSV (None keeps all of them). Note that the field
+# order in the pagelinks table contradicts documentation, fields 2 and 3 are
+# apparently the other way around. The pagelinks namespaces are always 0 after
+# filtering, so they are not kept.
+TABLES = [
+    ('page', [1], ['page_id', 'page_namespace', 'page_title',
+                   'page_is_redirect']),
+    ('redirect', [1], ['rd_from', 'rd_namespace', 'rd_title']),
+    ('pagelinks', [1, 3], ['pl_from', 'pl_title']),
+]
+
+# Columns stored as text rather than integers in the columnar layout
+TEXT_COLUMNS = {'page_title', 'rd_title', 'pl_title'}
+
+# Number of array elements copied at once when merging column files
+_COPY_CHUNK_SIZE = 2**24
 
-from mysqldump_to_csv import dump_to_csv
 
-def filter_for_main_namespace(input_filename, output_filename, field_indices):
+def _in_main_namespace(field_indices, row):
+    return all(row[idx] == '0' for idx in field_indices)
+
+
+def main_namespace_filter(field_indices):
     """
-    Given an input CSV and a set of field indices, output only those rows where
-    the corresponding columns contain 0.
+    Returns a row filter for dump_to_csv accepting only those rows where the
+    columns at the given field indices contain 0.
     Used to discard information not relating to the default Wikipedia namespace
     (e.g. talk or other meta pages).
     """
-    with open(input_filename, encoding='utf8') as input_file, \
-         open(output_filename, mode='w+',
-                encoding='utf8', newline='') as output_file:
-        reader = csv.reader(input_file)
-        writer = csv.writer(output_file, quoting=csv.QUOTE_MINIMAL)
-        for row in reader:
-            if all(row[idx] == '0' for idx in field_indices):
-                writer.writerow(row)
+    return functools.partial(_in_main_namespace, field_indices)
+
+
+def find_dump(dumps_dir, datadumps_prefix, table):
+    """
+    Returns the path of the dump of the given table, either uncompressed (.sql)
+    or compressed (.sql.gz, .sql.bz2).
+    """
+    base = os.path.join(dumps_dir, datadumps_prefix + '-' + table + '.sql')
+    for extension in [''] + list(COMPRESSED_FORMATS):
+        if os.path.exists(base + extension):
+            return base + extension
+    raise FileNotFoundError('No dump of the {} table found at {}'.format(
+        table, base))
+
+
+def split_at_inserts(input_filename, n_chunks):
+    """
+    Split a MySQL dump into at most n_chunks byte ranges of roughly equal size,
+    each starting at the beginning of an INSERT statement line (or the start of
+    the file). Returns a list of (start, end) offsets covering the whole file.
+    """
+    size = os.path.getsize(input_filename)
+    boundaries = [0]
+    with open(input_filename, 'rb') as dump:
+        for i in range(1, n_chunks):
+            offset = max(size * i // n_chunks, boundaries[-1])
+            dump.seek(offset)
+            # Skip the rest of the line the offset falls into, then move on to
+            # the next line that begins an INSERT statement.
+            if offset > 0:
+                offset += len(dump.readline())
+            for line in dump:
+                if is_insert(line):
+                    break
+                offset += len(line)
+            if offset > boundaries[-1] and offset < size:
+                boundaries.append(offset)
+    boundaries.append(size)
+    return list(zip(boundaries[:-1], boundaries[1:]))
+
+
+def dump_to_columns(input_filename, output_dir, row_filter=None,
+                    columns=None, start=0, end=None, decompress='inline',
+                    write_buffer_size=WRITE_BUFFER_SIZE, progress_interval=30):
+    """
+    Convert the INSERT statements of a dump to raw column files in output_dir,
+    with arguments as for dump_to_csv. Integer columns are written as int64
+    values (<column>.raw), text columns as concatenated UTF-8 bytes
+    (<column>.raw) and the int64 offsets at which each value ends
+    (<column>.ends). Use merge_columns to turn one or more such directories
+    into the final columnar layout.
+    """
+    names = get_column_names(input_filename)
+    columns = column_indices(input_filename,
+                             range(len(names)) if columns is None else columns)
+    os.makedirs(output_dir, exist_ok=True)
+    progress = ConversionProgress(progress_interval)
+    with contextlib.ExitStack() as stack:
+        files = {}
+        for column in columns:
+            name = names[column]
+            files[name] = stack.enter_context(
+                open(os.path.join(output_dir, name + '.raw'), 'wb',
+                     buffering=write_buffer_size))
+            if name in TEXT_COLUMNS:
+                files[name + '.ends'] = stack.enter_context(
+                    open(os.path.join(output_dir, name + '.ends'), 'wb',
+                         buffering=write_buffer_size))
+        text_length = {name: 0 for name in files}
+        for values in iter_statements(input_filename, start, end, decompress):
+            rows = list(select_rows(values, row_filter, columns))
+            progress.update(len(values), len(rows))
+            if not rows:
+                continue
+            for column, column_values in zip(columns, zip(*rows)):
+                name = names[column]
+                if name in TEXT_COLUMNS:
+                    encoded = [value.encode('utf-8') for value in column_values]
+                    ends = np.cumsum([len(value) for value in encoded],
+                                     dtype=np.int64) + text_length[name]
+                    ends.tofile(files[name + '.ends'])
+                    files[name].write(b''.join(encoded))
+                    text_length[name] = int(ends[-1])
+                else:
+                    np.fromiter(map(int, column_values), dtype=np.int64,
+                                count=len(column_values)).tofile(files[name])
+    if progress_interval is not None:
+        progress.report()
+    return [names[column] for column in columns]
+
+
+def _write_npy_header(output_file, length):
+    np.lib.format.write_array_header_1_0(output_file, {
+        'descr': np.lib.format.dtype_to_descr(np.dtype(np.int64)),
+        'fortran_order': False,
+        'shape': (length,),
+    })
+
+
+def merge_columns(part_dirs, output_dir, names):
+    """
+    Concatenate the raw column files written by dump_to_columns in each of the
+    part directories (in order) into the columnar layout in output_dir, and
+    remove the part directories.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    for name in names:
+        raw_files = [os.path.join(part_dir, name + '.raw')
+                     for part_dir in part_dirs]
+        if name in TEXT_COLUMNS:
+            ends_files = [os.path.join(part_dir, name + '.ends')
+                          for part_dir in part_dirs]
+            length = sum(os.path.getsize(f) // 8 for f in ends_files)
+            with open(os.path.join(output_dir, name + '.offsets.npy'),
+                      'wb') as offsets_file, \
+                 open(os.path.join(output_dir, name + '.bytes'),
+                      'wb') as bytes_file:
+                _write_npy_header(offsets_file, length + 1)
+                np.zeros(1, dtype=np.int64).tofile(offsets_file)
+                base = 0
+                for raw_file, ends_file in zip(raw_files, ends_files):
+                    if os.path.getsize(ends_file) > 0:
+                        ends = np.memmap(ends_file, dtype=np.int64, mode='r')
+                        for i in range(0, len(ends), _COPY_CHUNK_SIZE):
+                            (ends[i:i+_COPY_CHUNK_SIZE] + base).tofile(
+                                offsets_file)
+                        del ends
+                    with open(raw_file, 'rb') as part_file:
+                        shutil.copyfileobj(part_file, bytes_file)
+                    base = bytes_file.tell()
+        else:
+            length = sum(os.path.getsize(f) // 8 for f in raw_files)
+            with open(os.path.join(output_dir, name + '.npy'),
+                      'wb') as output_file:
+                _write_npy_header(output_file, length)
+                for raw_file in raw_files:
+                    with open(raw_file, 'rb') as part_file:
+                        shutil.copyfileobj(part_file, output_file)
+    for part_dir in part_dirs:
+        shutil.rmtree(part_dir)
+
+
+def convert_range(task):
+    """
+    Convert the INSERT statements in one byte range of a dump with the given
+    conversion function (dump_to_csv or dump_to_columns), without printing
+    progress. Takes a single (convert, input_filename, output, start, end,
+    row_filter, columns) tuple so that it can be mapped over a process pool.
+    """
+    convert, input_filename, output, start, end, row_filter, columns = task
+    convert(input_filename, output, row_filter, columns, start, end,
+            progress_interval=None)
+    return output
+
+
+def parallel_convert(convert, input_filename, output, row_filter=None,
+                     columns=None, processes=1):
+    """
+    Run convert (dump_to_csv or dump_to_columns) on ranges of INSERT statements
+    of a dump in a pool of worker processes, each writing its own part file or
+    directory. Yields the parts in file order as they are finished, printing
+    progress after each.
+    """
+    ranges = split_at_inserts(input_filename, processes * 4)
+    tasks = [(convert, input_filename, '{}.part{}'.format(output, i),
+              start, end, row_filter, columns)
+             for i, (start, end) in enumerate(ranges)]
+    # Parts left over by an interrupted run would be appended to
+    for task in tasks:
+        part = task[2]
+        if os.path.isdir(part):
+            shutil.rmtree(part)
+        elif os.path.exists(part):
+            os.remove(part)
+    start_time = time.time()
+    with Pool(processes) as pool:
+        for i, part in enumerate(pool.imap(convert_range, tasks)):
+            elapsed = max(time.time() - start_time, 1e-9)
+            print(datetime.now().strftime('%H:%M:%S'),
+                  'Converted part {} of {}, {:.1f} MB/s'.format(
+                      i + 1, len(tasks), ranges[i][1] / 2**20 / elapsed))
+            yield part
+
+
+def parallel_dump_to_csv(input_filename, output_filename, row_filter=None,
+                         columns=None, processes=1):
+    """
+    Convert a dump to CSV like dump_to_csv, using a pool of worker processes.
+    Part files are appended to the output as they are finished, so rows keep
+    the order of the dump.
+    """
+    if columns is not None:
+        columns = column_indices(input_filename, columns)
+    with open(output_filename, 'wb') as output_file:
+        for part_filename in parallel_convert(dump_to_csv, input_filename,
+                                              output_filename, row_filter,
+                                              columns, processes):
+            if os.path.exists(part_filename):
+                with open(part_filename, 'rb') as part_file:
+                    shutil.copyfileobj(part_file, output_file)
+                os.remove(part_filename)
+
+
+def dump_to_columnar_table(input_filename, output_dir, row_filter=None,
+                           columns=None, processes=1, decompress='inline',
+                           progress_interval=30):
+    """
+    Convert a dump to the columnar layout in output_dir, in parallel if more
+    than one process is given and the dump is uncompressed.
+    """
+    if columns is None:
+        columns = get_column_names(input_filename)
+    columns = column_indices(input_filename, columns)
+    if processes > 1 and not is_compressed(input_filename):
+        part_dirs = list(parallel_convert(dump_to_columns, input_filename,
+                                          output_dir, row_filter, columns,
+                                          processes))
+        names = [get_column_names(input_filename)[c] for c in columns]
+    else:
+        part_dirs = [output_dir + '.part0']
+        names = dump_to_columns(input_filename, part_dirs[0], row_filter,
+                                columns, decompress=decompress,
+                                progress_interval=progress_interval)
+    merge_columns(part_dirs, output_dir, names)
+
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(
         description='Preprocess MySQL dumps of required Wikipedia tables')
     parser.add_argument('--dumps-dir',
-        help='The directory containing the uncompressed datadumps')
+        help='The directory containing the datadumps, either uncompressed or '
+             'compressed with gzip or bzip2')
     parser.add_argument('--datadumps-prefix',
         help='Prefix common to all table files, e.g. "wneiki-20190820"')
+    parser.add_argument('--processes', type=int, default=1,
+        help='Number of worker processes. With more than one, each dump is '
+             'split at INSERT statements and converted in parallel (only '
+             'for uncompressed dumps)')
+    parser.add_argument('--decompress', default='thread',
+        choices=['inline', 'thread', 'process'],
+        help='Where compressed dumps are decompressed: in the parsing thread, '
+             'in a background thread or by an external tool such as pigz in a '
+             'separate process')
+    parser.add_argument('--format', default='csv',
+        choices=['csv', 'columnar'],
+        help='Write each table as a CSV file (<table>.csv) or in the '
+             'memory-mappable columnar layout (<table>/ directory)')
     args = parser.parse_args()
 
-    # List the appropriate indices for each table. Note that the field order
-    # in the pagelinks table contradicts documentation, fields 2 and 3 are
-    # apparently the other way around.
-    for table, filter_indices in [('page', [1]),
-                                  ('redirect', [1]),
-                                  ('pagelinks', [1, 3])]:
-        source = os.path.join(args.dumps_dir,
-                              args.datadumps_prefix + '-' + table +'.sql')
-        intermediate = os.path.join(args.dumps_dir,
-                                    table + '-unfiltered-temp.csv')
+    for table, filter_indices, columns in TABLES:
+        source = find_dump(args.dumps_dir, args.datadumps_prefix, table)
+        row_filter = main_namespace_filter(filter_indices)
+        if args.format == 'columnar':
+            dump_to_columnar_table(source, os.path.join(args.dumps_dir, table),
+                                   row_filter, columns, args.processes,
+                                   args.decompress)
+            continue
         result = os.path.join(args.dumps_dir, table + '.csv')
-        dump_to_csv(source, intermediate)
-        filter_for_main_namespace(intermediate, result, filter_indices)
-        os.remove(intermediate)
+        if os.path.exists(result):
+            os.remove(result)
+        if args.processes > 1 and not is_compressed(source):
+            parallel_dump_to_csv(source, result, row_filter, columns,
+                                 args.processes)
+        else:
+            dump_to_csv(source, result, row_filter, columns,
+                        decompress=args.decompress)
@@ -3,12 +3,13 @@ Subroutines to turn the graph dataset into vectorised form and output JSON
 metadata, specifying data splits and vectorising article text features.
 """
 import numpy as np
+import scipy.sparse as sp
 import json
-import random
-import sys
-import pickle
+import argparse
+from dataset_store import load_dataset
 import os
 import word_frequencies
+from wiki_node import shared_token_ids
 
 def label_set(nodes):
     """
@@ -17,39 +18,164 @@ def label_set(nodes):
     return {n.label for n in nodes.values()}
 
 
-def add_binary_word_vectors(nodes, words):
-    for id,node in nodes.items():
-        token_set = set(node.tokens)
-        node.vector = np.concatenate(
-            (node.vector,
-            np.array([bool(word in token_set) for word in words]))
-        )
-
-
-def add_glove_word_vectors(nodes, glove_dict, words_whitelist=None):
-    zeros = []
-    for id,node in nodes.items():
-        sum = np.zeros(len(next(iter(glove_dict.values()))))
-        for t in node.tokens:
-            if (t in glove_dict and
-                (words_whitelist is None or t in words_whitelist)):
-                sum += glove_dict[t]
-        if np.linalg.norm(sum) == 0.0:
-            zeros += [node.title];
-        node.vector = np.concatenate((node.vector, sum/len(node.tokens)))
+def token_count_matrix(node_list):
+    """
+    Get a sparse matrix counting the occurrences of each vocabulary word (by
+    column) in each of the given nodes (by row), with the shared vocabulary.
+    """
+    vocab, token_ids = shared_token_ids(node_list)
+    lengths = np.array([len(ids) for ids in token_ids], dtype=np.int64)
+    indptr = np.zeros(len(node_list) + 1, dtype=np.int64)
+    np.cumsum(lengths, out=indptr[1:])
+    indices = (np.concatenate(token_ids) if token_ids
+               else np.zeros(0, dtype=np.int32))
+    counts = sp.csr_matrix(
+        (np.ones(len(indices)), indices, indptr),
+        shape=(len(node_list), len(vocab)))
+    counts.sum_duplicates()
+    return counts, vocab
+
+
+def bag_of_words_matrix(nodes, ids, words=None, binary=True):
+    """
+    Get sparse bag-of-words features of the nodes with the given IDs as a
+    float32 CSR matrix with a row per node. Columns are the given words, or
+    the words occurring in these nodes in vocabulary order. Features are word
+    presence if binary, otherwise word counts.
+    """
+    counts, vocab = token_count_matrix([nodes[id] for id in ids])
+    if words is None:
+        counts = counts[:, np.flatnonzero(counts.getnnz(axis=0))]
+    else:
+        columns = np.array([vocab.word_ids.get(w, -1) for w in words],
+                           dtype=np.int64)
+        known = columns >= 0
+        counts = counts[:, np.where(known, columns, 0)] @ sp.diags(
+            known.astype(np.float64))
+        counts.eliminate_zeros()
+    counts = sp.csr_matrix(counts, dtype=np.float32)
+    if binary:
+        counts.data[:] = 1
+    return counts
+
+
+def add_glove_word_vectors(nodes, glove_dict, words_whitelist=None,
+                           tfidf=False):
+    """
+    Append the average GloVe vector of the tokens of each node to its vector,
+    counting only words in the whitelist if given and optionally weighting
+    words by inverse document frequency. Tokens without a GloVe vector count
+    towards the number of tokens averaged over.
+
+    Computed as the product of a sparse node-word count matrix with the matrix
+    of word vectors, returns the node IDs and the dense matrix of averages.
+    """
+    ids = list(nodes)
+    node_list = [nodes[id] for id in ids]
+    counts, vocab = token_count_matrix(node_list)
+    lengths = np.asarray(counts.sum(axis=1)).ravel()
+
+    columns = np.array([
+        i for i, word in enumerate(vocab.words)
+        if word in glove_dict
+            and (words_whitelist is None or word in words_whitelist)
+    ], dtype=np.int64)
+    counts = counts[:, columns]
+    if len(columns) > 0:
+        embeddings = np.stack([glove_dict[vocab.words[i]] for i in columns])
+    else:
+        embeddings = np.zeros((0, len(next(iter(glove_dict.values())))))
+    if tfidf:
+        doc_freqs = np.bincount(counts.indices, minlength=len(columns))
+        idf = np.log((1 + len(ids)) / (1 + doc_freqs)) + 1
+        counts = counts @ sp.diags(idf)
+
+    features = np.asarray(counts @ embeddings, dtype=np.float64)
+    features /= np.maximum(lengths, 1)[:, None]
+
+    zeros = [node_list[i].title
+             for i in np.flatnonzero(~features.any(axis=1))]
     print(len(zeros), 'nodes with no words in glove dict:', zeros)
+    for node, row in zip(node_list, features):
+        node.vector = (row if len(node.vector) == 0
+                       else np.concatenate((node.vector, row)))
+    return ids, features
+
+
+def glove_index_filenames(glove_file):
+    """
+    Get the names of the matrix and word list files converted from a GloVe
+    embedding file, stored next to it.
+    """
+    return glove_file + '.npy', glove_file + '.words.txt'
+
+
+def convert_glove_file(glove_file):
+    """
+    Convert a GloVe embedding text file into a float32 matrix in .npy form with
+    one row per word, plus a file listing the words in row order.
+    """
+    matrix_filename, words_filename = glove_index_filenames(glove_file)
+    with open(glove_file, 'rb') as input:
+        n_words = sum(1 for line in input)
+    with open(glove_file, 'r', encoding='utf8') as input:
+        first = input.readline().rstrip('\n').split(' ')
+    dim = len(first) - 1
+
+    tmp_matrix_filename = matrix_filename + '.tmp'
+    tmp_words_filename = words_filename + '.tmp'
+    matrix = np.lib.format.open_memmap(tmp_matrix_filename, mode='w+',
+                                       dtype=np.float32, shape=(n_words, dim))
+    with open(glove_file, 'r', encoding='utf8') as input, \
+            open(tmp_words_filename, 'w', encoding='utf8') as words:
+        for row, line in enumerate(input):
+            l = line.rstrip('\n').split(' ')
+            # Some GloVe vocabularies contain words with spaces
+            words.write(' '.join(l[:-dim]) + '\n')
+            matrix[row] = np.array(l[-dim:], dtype=np.float32)
+    matrix.flush()
+    del matrix
+    os.replace(tmp_matrix_filename, matrix_filename)
+    os.replace(tmp_words_filename, words_filename)
+
+
+def load_glove_matrix(glove_file):
+    """
+    Load GloVe embeddings as a map from words to row indices and a
+    memory-mapped matrix of word vectors, converting the text file on first
+    use or when it has changed since it was converted.
+    """
+    matrix_filename, words_filename = glove_index_filenames(glove_file)
+    if (not os.path.exists(matrix_filename)
+            or not os.path.exists(words_filename)
+            or os.path.getmtime(matrix_filename) < os.path.getmtime(glove_file)):
+        print('Converting', glove_file, 'to', matrix_filename, '...')
+        convert_glove_file(glove_file)
+    with open(words_filename, 'r', encoding='utf8') as words:
+        word_rows = {}
+        for row, word in enumerate(words):
+            word_rows[word.rstrip('\n')] = row
+    return word_rows, np.load(matrix_filename, mmap_mode='r')
 
 
-def load_glove_dict(filename, relevant_words=None):
-    result = {}
-    with open(filename, 'r', encoding='utf8') as input:
-        for line in input:
-            l = line.split(' ')
-            word = l[0]
-            if relevant_words is None or word in relevant_words:
-                weights = np.array([float(x) for x in l[1:]])
-                result[word] = weights
-    return result
+def load_glove_dict(filename, relevant_words=None, glove_matrix=None):
+    """
+    Load GloVe embeddings of the given words (all words by default) as a map
+    from words to vectors, reading only their rows of the converted matrix.
+    The result of load_glove_matrix can be passed as glove_matrix to share it
+    between calls.
+    """
+    word_rows, matrix = (load_glove_matrix(filename) if glove_matrix is None
+                         else glove_matrix)
+    if relevant_words is None:
+        words = list(word_rows)
+    else:
+        words = [w for w in relevant_words if w in word_rows]
+    rows = np.array([word_rows[w] for w in words], dtype=np.int64)
+    order = np.argsort(rows)
+    vectors = np.empty((len(words), matrix.shape[1]), dtype=matrix.dtype)
+    vectors[order] = matrix[rows[order]]
+    return dict(zip(words, vectors))
 
 
 def raw_data_dict(node):
@@ -62,90 +188,272 @@ def raw_data_dict(node):
     }
 
 
-def output_data(nodes, vectors_outfile, raw_data_outfile, train_ratio=0.05,
-                test_ratio=0.5, stopping_ratio = 0.3, n_train_splits = 20,
-                seed=42):
-    rnd = random.Random(seed)
-    labels = list(label_set(nodes))
-    node_ids_for_labels = {lab: [] for lab in labels}
-    all_ids_list = []
-    for node in nodes.values():
-        node_ids_for_labels[node.label].append(node.id)
-        all_ids_list.append(node.id)
-
-    test_ids = set()
-    train_sets = [set() for _ in range(n_train_splits)]
-    stopping_sets = [set() for _ in range(n_train_splits)]
-    val_sets = [set() for _ in range(n_train_splits)]
-    for lab in labels:
-        ids = node_ids_for_labels[lab]
-        rnd.shuffle(ids)
-        n_train = int(train_ratio*len(ids))
+def generate_splits(label_vec, n_splits, train_ratio=0.05, test_ratio=0.5,
+                    stopping_ratio=0.3, seed=42):
+    """
+    Randomly split nodes, stratified by label, into a test set shared by all
+    splits and n_splits random partitions of the remaining nodes into train,
+    stopping and validation sets. The fraction of each label in each set is
+    given by the ratios, the validation set getting the rest.
+
+    Returns the test mask and the train, stopping and validation masks of each
+    split (in rows) as bit arrays packed with np.packbits.
+    """
+    label_vec = np.asarray(label_vec)
+    n_nodes = len(label_vec)
+    rng = np.random.RandomState(seed)
+    test_mask = np.zeros(n_nodes, dtype=bool)
+    visible_for_labels = []
+    for lab in np.unique(label_vec):
+        ids = rng.permutation(np.flatnonzero(label_vec == lab))
         n_test = int(test_ratio*len(ids))
+        n_train = int(train_ratio*len(ids))
         n_stopping = int(stopping_ratio*len(ids))
+        test_mask[ids[:n_test]] = True
+        visible_for_labels.append((ids[n_test:], n_train, n_stopping))
 
-        test_ids.update(ids[:n_test])
-        visible_ids = ids[n_test:]
-        for i in range(n_train_splits):
-            rnd.shuffle(visible_ids)
-            train_sets[i].update(visible_ids[:n_train])
-            stopping_sets[i].update(visible_ids[n_train : (n_train+n_stopping)])
-            val_sets[i].update(visible_ids[n_train+n_stopping:])
+    n_bytes = (n_nodes + 7) // 8
+    train_masks = np.zeros((n_splits, n_bytes), dtype=np.uint8)
+    stopping_masks = np.zeros((n_splits, n_bytes), dtype=np.uint8)
+    val_masks = np.zeros((n_splits, n_bytes), dtype=np.uint8)
+    for i in range(n_splits):
+        train = np.zeros(n_nodes, dtype=bool)
+        stopping = np.zeros(n_nodes, dtype=bool)
+        val = np.zeros(n_nodes, dtype=bool)
+        for visible, n_train, n_stopping in visible_for_labels:
+            visible = rng.permutation(visible)
+            train[visible[:n_train]] = True
+            stopping[visible[n_train:n_train+n_stopping]] = True
+            val[visible[n_train+n_stopping:]] = True
+        train_masks[i] = np.packbits(train)
+        stopping_masks[i] = np.packbits(stopping)
+        val_masks[i] = np.packbits(val)
+    return np.packbits(test_mask), train_masks, stopping_masks, val_masks
 
-    remap_node_ids = {old_id: new_id for new_id, old_id in enumerate(all_ids_list)}
 
-    test_mask = [(id in test_ids) for id in all_ids_list]
-    train_masks = [
-        [id in train_sets[i] for id in all_ids_list]
-            for i in range(n_train_splits)
-    ]
-    stopping_masks = [
-        [id in stopping_sets[i] for id in all_ids_list]
-            for i in range(n_train_splits)
-    ]
-    val_masks = [
-        [id in val_sets[i] for id in all_ids_list]
-            for i in range(n_train_splits)
-    ]
+def unpack_masks(packed, n_nodes):
+    """
+    Unpack masks packed by generate_splits into boolean arrays.
+    """
+    return np.unpackbits(packed, axis=-1)[..., :n_nodes].astype(bool)
+
 
-    node_features = [nodes[id].vector.tolist() for id in all_ids_list]
+def mask_indices(packed, n_nodes):
+    """
+    Get the indices of the nodes in each of the packed masks, as an array with
+    a row per mask (all masks of a kind select the same number of nodes).
+    """
+    masks = unpack_masks(np.atleast_2d(packed), n_nodes)
+    return np.nonzero(masks)[1].reshape(len(masks), -1)
+
+
+def output_binary_data(binary_outfile, features, labels_vec, links, packed_test,
+                       packed_train, packed_stopping, packed_val):
+    """
+    Write the vectorised data to a .npz file: float32 feature matrix, label
+    vector, links in CSR form (links_indptr, links_indices) and the indices of
+    the nodes in each mask. A sparse feature matrix is stored in CSR form
+    (features_data, features_indices, features_indptr, features_shape)
+    instead of as a dense features array. See binary_dataset.py for reading it.
+    """
+    n_nodes = len(labels_vec)
+    indptr = np.zeros(n_nodes + 1, dtype=np.int64)
+    np.cumsum([len(nbs) for nbs in links], out=indptr[1:])
+    indices = np.fromiter((nb for nbs in links for nb in nbs),
+                          dtype=np.int64, count=indptr[-1])
+    if sp.issparse(features):
+        features = sp.csr_matrix(features, dtype=np.float32)
+        feature_arrays = {
+            'features_data': features.data,
+            'features_indices': features.indices,
+            'features_indptr': features.indptr,
+            'features_shape': np.array(features.shape, dtype=np.int64),
+        }
+    else:
+        features = np.asarray(features, dtype=np.float32)
+        if features.ndim == 1:
+            # No nodes
+            features = features.reshape(0, 0)
+        feature_arrays = {'features': features}
+    np.savez(binary_outfile,
+             **feature_arrays,
+             labels=np.asarray(labels_vec, dtype=np.int64),
+             links_indptr=indptr,
+             links_indices=indices,
+             test_idx=mask_indices(packed_test, n_nodes)[0],
+             train_idx=mask_indices(packed_train, n_nodes),
+             stopping_idx=mask_indices(packed_stopping, n_nodes),
+             val_idx=mask_indices(packed_val, n_nodes))
+
+
+def write_json_object(output, items):
+    """
+    Write a JSON object with the given (key, value) items, writing values
+    that are iterators (rather than lists or dicts) as arrays one element per
+    line as they are generated, so they never need to be held in memory.
+
+    Each line after the first holds a single array element, so line-based
+    readers such as train.load_text_metadata can stream the arrays.
+    """
+    output.write('{')
+    for i, (key, value) in enumerate(items):
+        if i > 0:
+            output.write(', ')
+        output.write(json.dumps(key) + ': ')
+        if isinstance(value, (list, dict)):
+            output.write(json.dumps(value))
+            continue
+        output.write('[')
+        for j, element in enumerate(value):
+            output.write(',\n' if j > 0 else '\n')
+            output.write(json.dumps(element))
+        output.write('\n]')
+    output.write('}\n')
+
+
+def output_data(nodes, vectors_outfile, raw_data_outfile, train_ratio=0.05,
+                test_ratio=0.5, stopping_ratio = 0.3, n_train_splits = 20,
+                seed=42, splits_outfile=None, binary_outfile=None,
+                features=None):
+    """
+    Output vectorised data with random data splits to vectors_outfile and
+    readable data to raw_data_outfile, both JSON. If splits_outfile is given,
+    the packed split masks are also saved there in .npz form. If
+    binary_outfile is given, the vectorised data is also saved there in the
+    .npz form preferred by the training data loaders.
+
+    The features are the node vectors unless a feature matrix with a row per
+    node (in node order) is given, which may be sparse. Sparse features are
+    only written to binary_outfile, the vectors JSON then has no features.
+    """
+    labels = sorted(label_set(nodes))
     label_ids = {lab: i for i,lab in enumerate(labels)}
+    all_ids_list = list(nodes)
+    remap_node_ids = {old_id: new_id for new_id, old_id in enumerate(all_ids_list)}
     labels_vec = [label_ids[nodes[id].label] for id in all_ids_list]
+
+    packed_test, packed_train, packed_stopping, packed_val = generate_splits(
+        labels_vec, n_train_splits, train_ratio, test_ratio, stopping_ratio,
+        seed)
+    n_nodes = len(all_ids_list)
+    if splits_outfile is not None:
+        np.savez(splits_outfile, n_nodes=n_nodes,
+                 test_mask=packed_test, train_masks=packed_train,
+                 stopping_masks=packed_stopping, val_masks=packed_val)
     links = [
         [remap_node_ids[nb] for nb in nodes[id].outlinks]
             for id in all_ids_list
     ]
 
-    vector_data = {
-        'features': node_features,
-        'labels': labels_vec,
-        'links': links,
-        'train_masks': train_masks,
-        'stopping_masks': stopping_masks,
-        'val_masks': val_masks,
-        'test_mask': test_mask
-    }
-    raw_metadata = {
-        'labels': {i: lab for i,lab in enumerate(labels)},
-        'nodes': [raw_data_dict(nodes[id]) for id in all_ids_list]
-    }
-    json.dump(vector_data, open(vectors_outfile, 'w'))
-    json.dump(raw_metadata, open(raw_data_outfile, 'w'))
+    if binary_outfile is not None:
+        output_binary_data(
+            binary_outfile,
+            ([nodes[id].vector for id in all_ids_list] if features is None
+             else features),
+            labels_vec, links, packed_test, packed_train, packed_stopping,
+            packed_val)
+
+    if features is None:
+        feature_rows = (nodes[id].vector.tolist() for id in all_ids_list)
+    elif sp.issparse(features):
+        feature_rows = []
+    else:
+        feature_rows = (row.tolist() for row in features)
+    with open(vectors_outfile, 'w') as output:
+        write_json_object(output, [
+            ('features', feature_rows),
+            ('labels', labels_vec),
+            ('links', links),
+            ('train_masks', (unpack_masks(m, n_nodes).tolist()
+                             for m in packed_train)),
+            ('stopping_masks', (unpack_masks(m, n_nodes).tolist()
+                                for m in packed_stopping)),
+            ('val_masks', (unpack_masks(m, n_nodes).tolist()
+                           for m in packed_val)),
+            ('test_mask', unpack_masks(packed_test, n_nodes).tolist())
+        ])
+    with open(raw_data_outfile, 'w') as output:
+        write_json_object(output, [
+            ('labels', {i: lab for i,lab in enumerate(labels)}),
+            ('nodes', (raw_data_dict(nodes[id]) for id in all_ids_list))
+        ])
 
 
-def process_with_glove_vectors(data_dir, glove_file):
-    data = pickle.load(open(os.path.join(data_dir, 'fulldata.pickle'), 'rb'))
+def process_with_glove_vectors(data_dir, glove_file, tfidf=False,
+                               glove_matrix=None, output_args=None,
+                               frequencies_file=None, vocabulary_size=None):
+    """
+    Vectorise the dataset in data_dir with averaged GloVe word vectors and
+    output it, passing output_args as keyword arguments to output_data.
+
+    If frequencies_file (written by word_frequencies.save_frequencies) is
+    given, only the vocabulary_size most frequent words in it (all by
+    default) are averaged.
+    """
+    data = load_dataset(data_dir)
 
     # Select set of words that appear at all in dataset
     freqs = word_frequencies.dataset_word_frequencies(data)
     words = freqs.keys()
+    if frequencies_file is not None:
+        frequent_words = set(word_frequencies.most_frequent_words(
+            frequencies_file, vocabulary_size)[0])
+        words = [w for w in words if w in frequent_words]
 
-    glove = load_glove_dict(glove_file, relevant_words=words)
-    add_glove_word_vectors(data, glove)
+    glove = load_glove_dict(glove_file, relevant_words=words,
+                            glove_matrix=glove_matrix)
+    features = add_glove_word_vectors(data, glove, tfidf=tfidf)[1]
+    output_data(data,
+                os.path.join(data_dir, 'vectors.json'),
+                os.path.join(data_dir, 'readable.json'),
+                splits_outfile=os.path.join(data_dir, 'splits.npz'),
+                binary_outfile=os.path.join(data_dir, 'vectors.npz'),
+                features=features,
+                **(output_args or {}))
+
+
+def process_with_bag_of_words(data_dir, binary=True, output_args=None):
+    """
+    Vectorise the dataset in data_dir with sparse bag-of-words features (word
+    presence if binary, otherwise word counts) and output it, passing
+    output_args as keyword arguments to output_data. The features are only
+    stored in vectors.npz, in CSR form.
+    """
+    data = load_dataset(data_dir)
+    features = bag_of_words_matrix(data, list(data), binary=binary)
     output_data(data,
                 os.path.join(data_dir, 'vectors.json'),
-                os.path.join(data_dir, 'readable.json'))
+                os.path.join(data_dir, 'readable.json'),
+                splits_outfile=os.path.join(data_dir, 'splits.npz'),
+                binary_outfile=os.path.join(data_dir, 'vectors.npz'),
+                features=features,
+                **(output_args or {}))
 
 
 if __name__ == '__main__':
-    process_with_glove_vectors(sys.argv[1], sys.argv[2])
+    parser = argparse.ArgumentParser(
+        description='Vectorise an extracted dataset and output it with data '
+                    'splits')
+    parser.add_argument('data_dir', help='Directory of the extracted dataset')
+    parser.add_argument('glove_file', nargs='?',
+        help='GloVe embedding file, for averaged word vector features')
+    parser.add_argument('--bag-of-words', action='store_true',
+        help='Use sparse bag-of-words features instead of GloVe vectors')
+    parser.add_argument('--word-counts', action='store_true',
+        help='Count words in bag-of-words features rather than marking their '
+             'presence')
+    parser.add_argument('--frequencies-file',
+        help='Word frequencies saved by word_frequencies.save_frequencies, to '
+             'average GloVe vectors of the most frequent words only')
+    parser.add_argument('--vocabulary-size', type=int,
+        help='Number of most frequent words in --frequencies-file to use '
+             '(default: all)')
+    args = parser.parse_args()
+    if args.bag_of_words:
+        process_with_bag_of_words(args.data_dir, binary=not args.word_counts)
+    elif args.glove_file is None:
+        parser.error('a GloVe file is needed unless --bag-of-words is given')
+    else:
+        process_with_glove_vectors(args.data_dir, args.glove_file,
+                                   frequencies_file=args.frequencies_file,
+                                   vocabulary_size=args.vocabulary_size)
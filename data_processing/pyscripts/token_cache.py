@@ -0,0 +1,125 @@
+"""
+Persistent cache of tokenized article text keyed by page ID and revision ID,
+so that repeated dataset extractions skip tokenizing pages already seen.
+
+The cache is a directory holding an append-only file of records, each a header
+(page ID, revision ID, payload length) followed by the zlib-compressed tokens
+separated by newlines, and a file naming the tokenizer settings the tokens were
+produced with. The index from page IDs to records is rebuilt by scanning the
+record headers when the cache is opened; if a page is cached more than once,
+the last record wins.
+"""
+import os
+import struct
+import zlib
+
+_HEADER = struct.Struct('<qqI')
+RECORDS_FILENAME = 'tokens.bin'
+VERSION_FILENAME = 'version'
+
+
+class TokenCache:
+    """
+    Token cache stored in cache_dir for tokens produced with the tokenizer
+    settings described by the version string. Opening an existing cache with a
+    different version raises a ValueError. A read-only cache never writes to
+    the directory.
+
+    If page_ids is given, only records of those pages are indexed, so that the
+    index stays proportional to the pages of interest rather than to the whole
+    cache. An index taken from another cache over the same directory can be
+    given instead, to open it without scanning the records again.
+    """
+    def __init__(self, cache_dir, version, readonly=False, page_ids=None,
+                 index=None):
+        self.cache_dir = cache_dir
+        self.readonly = readonly
+        self.index = {} if index is None else index
+        self._reader = None
+        self._writer = None
+
+        version_filename = os.path.join(cache_dir, VERSION_FILENAME)
+        if os.path.exists(version_filename):
+            with open(version_filename, encoding='utf8') as version_file:
+                cached_version = version_file.read().strip()
+            if cached_version != version:
+                raise ValueError(
+                    'Token cache {} was built with tokenizer {}, not {}'.format(
+                        cache_dir, cached_version, version))
+        elif not readonly:
+            os.makedirs(cache_dir, exist_ok=True)
+            with open(version_filename, 'w', encoding='utf8') as version_file:
+                version_file.write(version + '\n')
+
+        self.records_filename = os.path.join(cache_dir, RECORDS_FILENAME)
+        if index is None and os.path.exists(self.records_filename):
+            self._scan(page_ids)
+
+    def _scan(self, page_ids=None):
+        """
+        Build the index from the record headers (of the given pages only, if
+        any), truncating a partially written record at the end of the file.
+        """
+        size = os.path.getsize(self.records_filename)
+        offset = 0
+        with open(self.records_filename, 'rb') as records:
+            while offset + _HEADER.size <= size:
+                page_id, revid, length = _HEADER.unpack(
+                    records.read(_HEADER.size))
+                if offset + _HEADER.size + length > size:
+                    break
+                if page_ids is None or page_id in page_ids:
+                    self.index[page_id] = (revid, offset + _HEADER.size,
+                                           length)
+                offset += _HEADER.size + length
+                records.seek(offset)
+        if offset < size and not self.readonly:
+            with open(self.records_filename, 'r+b') as records:
+                records.truncate(offset)
+
+    def __len__(self):
+        return len(self.index)
+
+    def contains(self, page_id, revid):
+        entry = self.index.get(page_id)
+        return entry is not None and entry[0] == revid
+
+    def get(self, page_id, revid):
+        """
+        Get the cached tokens of the given revision of a page, or None.
+        """
+        if not self.contains(page_id, revid):
+            return None
+        _, offset, length = self.index[page_id]
+        if self._reader is None:
+            self._reader = open(self.records_filename, 'rb')
+        self._reader.seek(offset)
+        text = zlib.decompress(self._reader.read(length)).decode('utf-8')
+        return text.split('\n') if text else []
+
+    def add(self, page_id, revid, tokens):
+        """
+        Append the tokens of the given revision of a page to the cache.
+        """
+        if self.readonly:
+            raise ValueError('Token cache {} is read-only'.format(
+                self.cache_dir))
+        payload = zlib.compress('\n'.join(tokens).encode('utf-8'), 1)
+        if self._writer is None:
+            self._writer = open(self.records_filename, 'ab')
+        offset = self._writer.tell()
+        self._writer.write(_HEADER.pack(page_id, revid, len(payload)))
+        self._writer.write(payload)
+        self.index[page_id] = (revid, offset + _HEADER.size, len(payload))
+
+    def close(self):
+        for f in (self._reader, self._writer):
+            if f is not None:
+                f.close()
+        self._reader = self._writer = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
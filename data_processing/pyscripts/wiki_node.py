@@ -1,16 +1,114 @@
 import numpy as np
 
+class Vocabulary:
+    """
+    Mapping between words and integer IDs, shared by the nodes of a dataset so
+    that each word is stored only once however many articles contain it.
+    """
+    def __init__(self, words=()):
+        self.words = []
+        self.word_ids = {}
+        for word in words:
+            self.add(word)
+
+    def __len__(self):
+        return len(self.words)
+
+    def __contains__(self, word):
+        return word in self.word_ids
+
+    def add(self, word):
+        """Get the ID of a word, adding it to the vocabulary if missing."""
+        id = self.word_ids.get(word)
+        if id is None:
+            id = self.word_ids[word] = len(self.words)
+            self.words.append(word)
+        return id
+
+    def encode(self, tokens):
+        """Get an int32 array of IDs of the given tokens."""
+        return np.fromiter((self.add(t) for t in tokens), dtype=np.int32,
+                           count=len(tokens))
+
+    def decode(self, token_ids):
+        """Get the list of words with the given IDs."""
+        words = self.words
+        return [words[i] for i in token_ids.tolist()]
+
+    def __getstate__(self):
+        # Tokens never contain whitespace, so the words can be stored as a
+        # single string and the ID map rebuilt on load
+        return '\n'.join(self.words)
+
+    def __setstate__(self, state):
+        self.words = state.split('\n') if state else []
+        self.word_ids = {word: i for i, word in enumerate(self.words)}
+
+
+def shared_token_ids(nodes):
+    """
+    Get a vocabulary shared by the given nodes and their token ID arrays in
+    it, re-encoding the tokens if the nodes do not all share one already.
+    """
+    vocab = nodes[0].vocab if nodes else Vocabulary()
+    if all(node.vocab is vocab for node in nodes):
+        return vocab, [node.token_ids for node in nodes]
+    vocab = Vocabulary()
+    return vocab, [vocab.encode(node.tokens) for node in nodes]
+
+
+# Vocabulary for nodes created without one and nodes pickled with tokens stored
+# as lists of strings
+_default_vocab = Vocabulary()
+
+
 class WikiDataNode:
     """
     Represent extracted data about a single node in the Wikipedia graph (i.e. a
     single article): page ID, title, outgoing links to other nodes in dataset,
     tokens in article text, class label. Also vectorized feature representation
     to be cocatenated by appropriate functions.
+
+    Tokens are stored as an array of IDs in a vocabulary which should be shared
+    by all nodes in a dataset, the tokens property gives them as strings.
     """
-    def __init__(self, id, title, label, outlinks, tokens):
+    __slots__ = ('id', 'title', 'label', 'outlinks', 'vocab', 'token_ids',
+                 'vector')
+
+    def __init__(self, id, title, label, outlinks, tokens, vocab=None):
         self.id = id
         self.title = title
         self.outlinks = outlinks
-        self.tokens = tokens
+        self.vocab = _default_vocab if vocab is None else vocab
+        self.token_ids = self.vocab.encode(tokens)
         self.label = label
         self.vector = np.array([])
+
+    @classmethod
+    def from_token_ids(cls, id, title, label, outlinks, token_ids, vocab):
+        """Create a node from tokens given as an array of IDs in vocab."""
+        node = cls.__new__(cls)
+        node.__setstate__({'id': id, 'title': title, 'label': label,
+                           'outlinks': outlinks, 'vocab': vocab,
+                           'token_ids': token_ids, 'vector': np.array([])})
+        return node
+
+    @property
+    def tokens(self):
+        return self.vocab.decode(self.token_ids)
+
+    @tokens.setter
+    def tokens(self, tokens):
+        self.token_ids = self.vocab.encode(tokens)
+
+    def __getstate__(self):
+        return {name: getattr(self, name) for name in self.__slots__}
+
+    def __setstate__(self, state):
+        if 'tokens' in state:
+            state = dict(state)
+            tokens = state.pop('tokens')
+            state['vocab'] = _default_vocab
+            state['token_ids'] = _default_vocab.encode(tokens)
+        for name, value in state.items():
+            setattr(self, name, value)
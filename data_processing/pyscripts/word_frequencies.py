@@ -8,7 +8,12 @@ import numpy as np
 import os
 import json
 import string
+import heapq
 import nltk
+from collections import Counter
+from multiprocessing import Pool
+from dataset_store import DatasetStore
+from wiki_node import shared_token_ids
 
 try:
     nltk.data.find('tokenizers/punkt')
@@ -16,34 +21,122 @@ except LookupError:
     nltk.download('punkt')
 
 
-def get_entire_wiki_word_frequencies(text_extractor_data_dir, output=None):
+def count_file_words(filename):
     """
-    Get frequencies of all words from extracted Wikipedia text.
+    Count the lowercase tokens, excluding punctuation, in a single file of
+    WikiExtractor output.
     """
-    freqs = {}
-    for root, dirs, files in os.walk(text_extractor_data_dir):
-        for file in files:
-            for line in open(os.path.join(root, file), "r", encoding='utf8'):
-                entry = json.loads(line)
-                tokens = [t.lower() for t in nltk.word_tokenize(entry['text'])
-                                            if t not in string.punctuation]
-                for t in tokens:
-                    freqs[t] = freqs.get(t, 0) + 1
+    counts = Counter()
+    for line in open(filename, "r", encoding='utf8'):
+        entry = json.loads(line)
+        counts.update(t.lower() for t in nltk.word_tokenize(entry['text'])
+                                    if t not in string.punctuation)
+    return counts
+
+
+def prune_counts(counts, max_words):
+    """
+    Reduce counts to at most max_words words in place, in the manner of the
+    Misra-Gries heavy hitters summary: subtract the count of the
+    (max_words+1)-th most frequent word from all counts and drop the words
+    left without a positive count. Pruned counts can be merged and pruned
+    again, each count being underestimated by at most the total count
+    divided by max_words+1.
+    """
+    if len(counts) <= max_words:
+        return counts
+    threshold = heapq.nlargest(max_words + 1, counts.values())[-1]
+    for word, count in list(counts.items()):
+        if count > threshold:
+            counts[word] = count - threshold
+        else:
+            del counts[word]
+    return counts
+
+
+def get_entire_wiki_word_frequencies(text_extractor_data_dir, output=None,
+                                     processes=None, max_words=None):
+    """
+    Get frequencies of all words from extracted Wikipedia text, counting the
+    extracted files in parallel by the given number of processes (all CPUs by
+    default) and merging the counts.
+
+    If max_words is given, memory is bounded by keeping only approximate
+    counts of about that many most frequent words (see prune_counts).
+
+    The frequencies are written to output if given, as indented JSON if its
+    name ends with .json and otherwise in the binary form of
+    save_frequencies.
+    """
+    filenames = [os.path.join(root, file)
+                 for root, dirs, files in os.walk(text_extractor_data_dir)
+                 for file in sorted(files)]
+    freqs = Counter()
+    with Pool(processes) as pool:
+        for counts in pool.imap_unordered(count_file_words, filenames,
+                                          chunksize=4):
+            freqs.update(counts)
+            if max_words is not None and len(freqs) > 2*max_words:
+                prune_counts(freqs, max_words)
+    if max_words is not None:
+        prune_counts(freqs, max_words)
+    freqs = dict(freqs)
     print('Calculated frequency of', len(freqs), 'words')
     if output is not None:
-        with open(output, 'w', encoding='utf8') as outfile:
-            json.dump(freqs, outfile, indent=1)
+        if output.endswith('.json'):
+            with open(output, 'w', encoding='utf8') as outfile:
+                json.dump(freqs, outfile, indent=1)
+        else:
+            save_frequencies(output, freqs)
     return freqs
 
 
+def save_frequencies(filename, freqs):
+    """
+    Save word frequencies in a compact binary form: an .npz file with the
+    counts in descending order and the UTF-8 words, separated by newlines, in
+    the same order.
+    """
+    words = desc_frequency_list(freqs)
+    # Written through a file object so that np.savez does not append .npz to
+    # the given name
+    with open(filename, 'wb') as output:
+        np.savez(output,
+                 counts=np.array([freqs[w] for w in words], dtype=np.int64),
+                 words=np.frombuffer('\n'.join(words).encode('utf-8'),
+                                     dtype=np.uint8))
+
+
+def most_frequent_words(filename, n=None):
+    """
+    Load the n most frequent words (all by default) with their counts from a
+    file written by save_frequencies, as a list of words in descending order
+    of frequency and an array of their counts.
+    """
+    with np.load(filename) as data:
+        text = data['words'].tobytes().decode('utf-8')
+        counts = data['counts']
+    words = text.split('\n') if text else []
+    if n is not None:
+        words, counts = words[:n], counts[:n]
+    return words, counts
+
+
 def dataset_word_frequencies(nodes):
     """
     Get frequency of words from an extracted dataset.
     """
+    if isinstance(nodes, DatasetStore):
+        vocab = nodes.vocab
+        token_ids = [np.asarray(nodes.tokens_ids)]
+    else:
+        vocab, token_ids = shared_token_ids(list(nodes.values()))
+    counts = np.bincount(np.concatenate(token_ids) if token_ids else [],
+                         minlength=len(vocab))
     freqs = {}
-    for node in nodes.values():
-        for t in node.tokens:
-            freqs[t.lower()] = freqs.get(t.lower(), 0) + 1
+    for i in np.flatnonzero(counts).tolist():
+        word = vocab.words[i].lower()
+        freqs[word] = freqs.get(word, 0) + int(counts[i])
     return freqs
 
 
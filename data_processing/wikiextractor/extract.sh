@@ -8,6 +8,7 @@
 # - Keep lists. List bullets will be marked by "BULLET::::".
 # - Keep tables. They're mostly garbage but can be removed later (remove "^!*").
 # - Remove disambiguation pages. Right now there is no use for them.
+# - Include revision IDs, which key the token cache of the dataset extraction.
 
 INPUT=$1
 PROCESSES=$2
@@ -16,6 +17,7 @@ OUTPUT=$4
 
 python WikiExtractor.py $INPUT \
        --json \
+       --revision \
        --processes $PROCESSES \
        --templates $TEMPLATES \
        --output $OUTPUT \
@@ -1,13 +1,50 @@
 import os.path
+import sys
 import numpy as np
+import scipy.sparse as sp
 import json
 import itertools
 import torch
 from torch_geometric.data.data import Data
 
+# The reader of the .npz export is shared with the data processing scripts
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             '..', '..', 'data_processing', 'pyscripts'))
+import binary_dataset
+
 DATA_PATH = os.path.join('..', '..', 'dataset', 'data.json')
 
+def load_binary_data(filename):
+    """
+    Load the .npz export written by process_dataset.py next to the vectors
+    JSON file.
+    """
+    raw = np.load(filename)
+    features = binary_dataset.binary_features(raw)
+    if sp.issparse(features):
+        # Sparse bag-of-words features, densified for the link prediction
+        # models
+        features = features.toarray()
+    features = torch.from_numpy(features)
+    labels = torch.from_numpy(raw['labels'])
+    src, dst = binary_dataset.link_arrays(raw)
+    edges = torch.from_numpy(np.vstack((src, dst)))
+    data = Data(x=features, edge_index=edges, y=labels)
+
+    train_masks, val_masks, stopping_masks, test_mask = \
+        binary_dataset.split_masks(raw)
+    data.train_masks = [torch.from_numpy(tr) for tr in train_masks]
+    data.val_masks = [torch.from_numpy(val) for val in val_masks]
+    data.stopping_masks = [torch.from_numpy(st) for st in stopping_masks]
+    data.test_mask = torch.from_numpy(test_mask)
+
+    return data
+
+
 def load_data(filename=DATA_PATH):
+    binary_filename = os.path.splitext(filename)[0] + '.npz'
+    if os.path.exists(binary_filename):
+        return load_binary_data(binary_filename)
     raw = json.load(open(filename))
     features = torch.FloatTensor(np.array(raw['features']))
     labels = torch.LongTensor(np.array(raw['labels']))
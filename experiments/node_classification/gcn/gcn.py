@@ -8,6 +8,7 @@ import torch
 import torch.nn as nn
 from dgl.nn.pytorch import GraphConv
 import dgl.function as fn
+from ..sparse_input import SparseInputLinear
 
 class GCN(nn.Module):
     def __init__(self,
@@ -17,10 +18,18 @@ class GCN(nn.Module):
                  n_classes,
                  n_layers,
                  activation,
-                 dropout):
+                 dropout,
+                 sparse_input=False):
         super(GCN, self).__init__()
         self.g = g
         self.layers = nn.ModuleList()
+        # GraphConv needs dense input, so sparse features (such as bag-of-words)
+        # are first projected to the hidden dimension
+        self.input_projection = None
+        if sparse_input:
+            self.input_projection = SparseInputLinear(in_feats, n_hidden,
+                                                      bias=False)
+            in_feats = n_hidden
         # input layer
         self.layers.append(GraphConv(in_feats, n_hidden, activation=activation))
         # hidden layers
@@ -33,6 +42,8 @@ class GCN(nn.Module):
 
     def forward(self, features):
         h = features
+        if self.input_projection is not None:
+            h = self.input_projection(h)
         for i, layer in enumerate(self.layers[:-1]):
             if i != 0:
                 h = self.dropout(h)
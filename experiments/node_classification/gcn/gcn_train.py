@@ -15,7 +15,8 @@ def gcn_model_fn(args, data):
                 data.n_classes,
                 args.n_hidden_layers,
                 F.relu,
-                args.dropout)
+                args.dropout,
+                sparse_input=data.features.is_sparse)
 
 
 def register_gcn_args(parser):
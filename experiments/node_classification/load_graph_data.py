@@ -1,12 +1,19 @@
 import numpy as np
+import scipy.sparse as sp
 import json
 import itertools
 import torch
 import networkx as nx
 import dgl.data
 import os.path
+import sys
 from dgl import DGLGraph
 
+# The reader of the .npz export is shared with the data processing scripts
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             '..', '..', 'data_processing', 'pyscripts'))
+import binary_dataset
+
 DATA_PATH = os.path.join('..', '..', 'dataset', 'data.json')
 
 class NodeClassificationDataset:
@@ -24,9 +31,72 @@ class NodeClassificationDataset:
         self.n_feats = n_feats
 
 
+def sparse_tensor(matrix):
+    """
+    Convert a scipy sparse matrix to a sparse float torch tensor.
+    """
+    matrix = matrix.tocoo()
+    indices = torch.LongTensor(np.vstack((matrix.row, matrix.col)))
+    values = torch.FloatTensor(matrix.data)
+    return torch.sparse.FloatTensor(indices, values, torch.Size(matrix.shape))
+
+
+def check_features(features, filename):
+    """
+    Fail if there are no features, as in the vectors JSON of datasets with
+    sparse bag-of-words features, which are only stored in the .npz export.
+    """
+    if features.dim() != 2 or (features.shape[0] > 0
+                               and features.shape[1] == 0):
+        raise ValueError(
+            '{} holds no features, load the .npz export written next to '
+            'it'.format(filename))
+
+
+def binary_filename(filename):
+    """
+    Get the name of the .npz export written by process_dataset.py next to a
+    vectors JSON file.
+    """
+    return os.path.splitext(filename)[0] + '.npz'
+
+
+def from_binary_file(filename):
+    data = np.load(filename)
+    features = binary_dataset.binary_features(data)
+    if sp.issparse(features):
+        features = sparse_tensor(features)
+    else:
+        features = torch.from_numpy(features)
+        check_features(features, filename)
+    labels = torch.from_numpy(data['labels'])
+    n_nodes = len(labels)
+    train_masks, val_masks, stopping_masks, test_mask = \
+        binary_dataset.split_masks(data)
+    train_masks = [torch.from_numpy(tr) for tr in train_masks]
+    val_masks = [torch.from_numpy(val) for val in val_masks]
+    stopping_masks = [torch.from_numpy(st) for st in stopping_masks]
+    test_mask = torch.from_numpy(test_mask)
+    n_feats = features.shape[1]
+    n_classes = len(np.unique(data['labels']))
+
+    g = DGLGraph()
+    g.add_nodes(n_nodes)
+    src, dst = binary_dataset.link_arrays(data)
+    n_edges = len(dst)
+    g.add_edges(src, dst)
+    # edges are directional in DGL; make them bi-directional
+    g.add_edges(dst, src)
+    return NodeClassificationDataset(g, features, labels, train_masks, stopping_masks,
+                                    val_masks, test_mask, n_edges, n_classes, n_feats)
+
+
 def from_file(filename):
+    if os.path.exists(binary_filename(filename)):
+        return from_binary_file(binary_filename(filename))
     data = json.load(open(filename))
     features = torch.FloatTensor(np.array(data['features']))
+    check_features(features, filename)
     labels = torch.LongTensor(np.array(data['labels']))
     if hasattr(torch, 'BoolTensor'):
         train_masks = [torch.BoolTensor(tr) for tr in data['train_masks']]
@@ -42,7 +112,7 @@ def from_file(filename):
     n_classes = len(set(data['labels']))
 
     g = DGLGraph()
-    g.add_nodes(len(data['features']))
+    g.add_nodes(features.shape[0])
     edge_list = list(itertools.chain(*[[(i, nb) for nb in nbs] for i,nbs in enumerate(data['links'])]))
     n_edges = len(edge_list)
     # add edges two lists of nodes: src and dst
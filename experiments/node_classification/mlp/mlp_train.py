@@ -4,11 +4,12 @@ import torch.nn as nn
 from .. import load_graph_data
 from ..train import train_and_eval
 from ..train import register_general_args
+from ..sparse_input import SparseInputLinear
 
 
 def mlp_model_fn(args, data):
     layers = []
-    layers.append(nn.Linear(data.n_feats, args.n_hidden))
+    layers.append(SparseInputLinear(data.n_feats, args.n_hidden))
     for i in range(args.n_hidden_layers - 1):
         layers.append(nn.Linear(args.n_hidden, args.n_hidden))
         layers.append(nn.ReLU())
@@ -0,0 +1,13 @@
+import torch
+import torch.nn as nn
+
+
+class SparseInputLinear(nn.Linear):
+    """Linear layer also accepting sparse input, such as bag-of-words features."""
+    def forward(self, input):
+        if input.is_sparse:
+            output = torch.sparse.mm(input, self.weight.t())
+            if self.bias is not None:
+                output = output + self.bias
+            return output
+        return super(SparseInputLinear, self).forward(input)
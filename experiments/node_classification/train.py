@@ -55,6 +55,32 @@ def strip_to_ascii(s):
     return ''.join(filter(lambda x: x in printable, s))
 
 
+def load_text_metadata(filename):
+    """
+    Load label names and node titles from readable data written by
+    process_dataset.py, reading one node at a time so that the node tokens
+    are never all held in memory. Returns a dict with the label names by
+    label ID (as a string) under 'labels' and a list of titles under 'titles'.
+    """
+    nodes_start = ', "nodes": ['
+    with open(filename) as inp:
+        header = inp.readline().rstrip('\n')
+        if not header.endswith(nodes_start):
+            # Readable data written as a single JSON document
+            inp.seek(0)
+            text_metadata = json.load(inp)
+            return {'labels': text_metadata['labels'],
+                    'titles': [node['title']
+                               for node in text_metadata['nodes']]}
+        labels = json.loads(header[:-len(nodes_start)] + '}')['labels']
+        titles = []
+        for line in inp:
+            if line.startswith(']'):
+                break
+            titles.append(json.loads(line.rstrip(',\n'))['title'])
+    return {'labels': labels, 'titles': titles}
+
+
 def compile_metadata(data, split_idx, text_metadata=None):
     labels = data.labels.cpu().tolist()
     splits = ['train' if data.train_masks[split_idx][i] else
@@ -65,7 +91,7 @@ def compile_metadata(data, split_idx, text_metadata=None):
     metadata_header = ['id', 'label_id', 'split']
     if text_metadata is not None:
         label_names = [text_metadata['labels'][str(lab)] for lab in labels]
-        node_names = [strip_to_ascii(text_metadata['nodes'][id]['title'])
+        node_names = [strip_to_ascii(text_metadata['titles'][id])
                         for id in ids]
         metadata_header += ['label_names', 'node_names']
         return (metadata_header,
@@ -211,8 +237,7 @@ def train_and_eval(model_fn, data, args, result_callback=None):
 
     text_metadata = None
     if args.metadata_file is not None:
-        with open(args.metadata_file) as inp:
-            text_metadata = json.load(inp)
+        text_metadata = load_text_metadata(args.metadata_file)
 
     if (args.max_splits is None or
         len(data.train_masks) <= (args.start_split + args.max_splits)):